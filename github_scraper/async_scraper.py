@@ -0,0 +1,361 @@
+import os
+import json
+import atexit
+import asyncio
+import threading
+import contextvars
+from collections import deque
+import aiohttp
+import http_client
+import scrape_cache
+import scrape_store
+import metrics
+import request_deadline
+import parse_pool
+import rate_limit
+import github_scraper
+from extraction_plan import PlanWatcher
+from github_scraper import REPO_PAGE_FIELDS, REPO_PAGE_OUTPUT_FIELDS, USER_REPO_ROW, ORG_REPO_ROW
+
+#asyncio counterparts of the scrape functions of github_scraper.py. They share its extractors, listing crawl and cache,
+#but every download is awaited on one event loop (the engine), so a scrape in flight holds no thread while it waits.
+ENGINE_CONNECTIONS = int(os.environ.get('GITHUB_SCRAPER_ASYNC_CONNECTIONS', 100))    #Connections open at once, over all hosts
+SHUTDOWN_TIMEOUT = 5                                                                 #Seconds to close the session at exit
+
+#What the shared helpers of github_scraper.py read from a response
+class AsyncResponse:
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+_session = None
+
+#The engine's event loop runs on its own thread, created on first use (and again in a forked worker process)
+def get_engine_loop():
+    global _loop, _loop_pid, _session
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _session = None
+            threading.Thread(target=_loop.run_forever, name='async-scraper', daemon=True).start()
+            atexit.register(shutdown, _loop)
+        return _loop
+
+#Closes the session (and its connections) on the engine's loop at exit, then stops the loop. A loop inherited from
+#the parent of a forked worker has no thread running it, it is left alone.
+def shutdown(loop):
+    if loop is not _loop or _loop_pid != os.getpid() or not loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_session(), loop).result(SHUTDOWN_TIMEOUT)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+#Runs a coroutine of this module on the engine and awaits its result, from any other event loop (e.g. a Flask async view).
+#Its stages are recorded in the spans of the caller's request, and it keeps to the request's deadline.
+async def run(coro):
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(with_request(coro, metrics.current_spans(), request_deadline.get_deadline()), get_engine_loop()))
+
+#Same as run, for a caller without an event loop
+def run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(with_request(coro, metrics.current_spans(), request_deadline.get_deadline()), get_engine_loop()).result()
+
+#The tasks started by coro inherit the spans and deadline of the calling request from its context
+async def with_request(coro, spans, deadline):
+    metrics.set_spans(spans)
+    request_deadline.set_deadline(deadline)
+    return await coro
+
+#The session (and its keep-alive connection pool) belongs to the engine's loop. The per-host limit of its connector
+#is the same politeness cap as GITHUB_SCRAPER_HOST_CONCURRENCY for the synchronous scraper.
+def get_session():
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=ENGINE_CONNECTIONS, limit_per_host=github_scraper.HOST_CONCURRENCY)
+        timeout = aiohttp.ClientTimeout(sock_connect=http_client.CONNECT_TIMEOUT, sock_read=http_client.READ_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout, cookie_jar=aiohttp.DummyCookieJar())
+    return _session
+
+#See github_scraper.get_with_backoff, both engines share the scheduler
+async def get_with_backoff(url, headers=None, stop_plan=None):
+    attempt = 1
+    while True:
+        wait = rate_limit.acquire()
+        request_deadline.check(wait)
+        metrics.record_wait(wait)
+        await asyncio.sleep(wait)
+        http_client.count('requests')
+        try:
+            with metrics.span('upstream'):
+                request_deadline.check()
+                async with get_session().get(url, headers=headers, **request_timeout()) as response:
+                    if stop_plan is not None and response.status == 200:
+                        content = await read_page_prefix(response, stop_plan)
+                    else:
+                        content = await response.read()
+            metrics.count_upstream(response.status, content)
+            delay = rate_limit.response_retry_delay(attempt, response.status, response.headers)
+            if delay is None:
+                if response.status >= 400:
+                    response.raise_for_status()
+                return AsyncResponse(url, response.status, response.headers, content)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+            metrics.count_upstream('error', b'')
+            delay = rate_limit.error_retry_delay(attempt)
+            if delay is None:
+                raise
+        request_deadline.check(delay)
+        rate_limit.retried()
+        metrics.count_retry()
+        metrics.record_wait(delay)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+#Timeout of one request, the whole of it bounded by what is left of the request's deadline (aiohttp takes a total of 0
+#for no timeout at all, request_deadline.bounded raises DeadlineExceeded instead)
+def request_timeout():
+    left = request_deadline.remaining()
+    if left is None:
+        return {}
+    return {"timeout": aiohttp.ClientTimeout(total=request_deadline.bounded(left), sock_connect=http_client.CONNECT_TIMEOUT, sock_read=http_client.READ_TIMEOUT)}
+
+#See github_scraper.read_page_prefix
+async def read_page_prefix(response, stop_plan):
+    watcher = PlanWatcher(stop_plan)
+    chunks = []
+    async for chunk in response.content.iter_chunked(github_scraper.STREAM_CHUNK):
+        chunks.append(chunk)
+        if watcher.feed_bytes(chunk):
+            break
+    content = b''.join(chunks)
+    if watcher.done:
+        #The body arrives decompressed, its size only compares to the announced length without a Content-Encoding
+        length = response.content_length if 'Content-Encoding' not in response.headers else None
+        metrics.count_truncated(length, len(content))
+        response.close()
+    return content
+
+#See github_scraper.extract_page. A page not sent to the parse pool is parsed on a thread of the loop's default executor,
+#the engine's loop goes on with the downloads of the other requests meanwhile.
+async def extract_page(content, extractor, *args):
+    parse_only = getattr(extractor, 'parse_only', None)
+    if parse_pool.offloaded(content):
+        return await parse_pool.extract_async(content, github_scraper.HTML_PARSER, github_scraper.strained(parse_only), extractor, args)
+    #In a copy of the task's context, for the spans of the request
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, github_scraper.extract_inline, content, extractor, *args)
+
+#See github_scraper.fetch_and_extract, the validators and extracted results are shared with it
+async def fetch_and_extract(url, extractor, *args):
+    result_key = json.dumps([extractor.__name__, args])
+    validated = scrape_cache.get_validated(url)
+
+    headers = {}
+    if validated is not None and result_key in validated["results"]:
+        if validated["etag"]:
+            headers['If-None-Match'] = validated["etag"]
+        if validated["last_modified"]:
+            headers['If-Modified-Since'] = validated["last_modified"]
+
+    response = await get_with_backoff(url, headers=headers, stop_plan=getattr(extractor, 'stop_plan', None) if github_scraper.STREAM_FETCH else None)
+    if response.status_code == 304 and headers:
+        scrape_cache.count('revalidated')
+        return validated["results"][result_key]
+
+    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
+        result = await extract_page(response.content, extractor, *args)
+        scrape_cache.set_validated(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), result_key, result)
+        return result
+    else:
+        return None
+
+@scrape_cache.cached('profile', serve_stale=True)
+async def scrape_profile(url, username):
+    try:
+        profile = await fetch_and_extract(url, github_scraper.extract_profile, url, username)
+        scrape_store.put_user(username, profile)
+        return profile
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
+            return None
+        raise
+
+#See github_scraper.scrape_account
+async def scrape_account(url, username):
+    profile = scrape_store.stored_user(username)
+    return profile if profile is not None else await scrape_profile(url, username)
+
+async def check_user_type(url):
+    username = url.rstrip('/').rsplit('/', 1)[-1]
+    profile = await scrape_profile(url, username)
+    return profile["type"] if profile is not None else None
+
+#Function for GET /users/{username}
+async def scrape_github_users_endpoint(url, username):
+    profile = await scrape_profile(url, username)
+    return profile["user"] if profile is not None else None
+
+#See github_scraper.stream_profiles, returns an async generator
+async def stream_profiles(usernames):
+    return iter_profiles(usernames)
+
+async def iter_profiles(usernames):
+    tasks = deque()
+    for username in usernames:
+        if not github_scraper.LOGIN_PATTERN.fullmatch(username):
+            tasks.append((username, None))
+            continue
+        tasks.append((username, asyncio.ensure_future(scrape_profile(f'{github_scraper.GITHUB_URL}/{username}', username))))
+        if len(tasks) >= github_scraper.ENRICH_WORKERS:
+            yield await profile_result(*tasks.popleft())
+    while tasks:
+        yield await profile_result(*tasks.popleft())
+
+async def scrape_profiles(usernames):
+    return [result async for result in iter_profiles(usernames)]
+
+async def profile_result(username, task):
+    if task is None:
+        return username, None
+    try:
+        return username, await task
+    except Exception as e:
+        return username, e
+
+async def fetch_listing_page(upstream_page, upstream_url, row_attrs):
+    try:
+        response = await get_with_backoff(upstream_url)
+    except aiohttp.ClientResponseError as e:
+        #A page past the end of the listing is simply empty
+        if upstream_page == 1 or e.status != 404:
+            raise
+        return None
+    return await extract_page(response.content, github_scraper.extract_listing_page, row_attrs) if response.status_code == 200 else None
+
+#Drives github_scraper.crawl_listing with awaited downloads
+async def scrape_listing(url, row_attrs, per_page, sort_by, direction, page):
+    crawl = github_scraper.crawl_listing(url, per_page, sort_by, direction, page)
+    try:
+        upstream_page, upstream_url = next(crawl)
+        while True:
+            upstream_page, upstream_url = crawl.send(await fetch_listing_page(upstream_page, upstream_url, row_attrs))
+    except StopIteration as stop:
+        return stop.value
+
+@scrape_cache.cached('repo_page')
+async def scrape_repo_page(url):
+    return await fetch_and_extract(url, github_scraper.extract_repo_page)
+
+#Fans the repo pages out as tasks, at most GITHUB_SCRAPER_WORKERS at a time per call. As in the synchronous
+#scraper a failing repo, or one still pending after GITHUB_SCRAPER_ENRICH_TIMEOUT, gets empty fields.
+async def scrape_repo_pages(urls):
+    return [repo_page async for repo_page in iter_repo_pages(urls)]
+
+#Same as scrape_repo_pages, but the tasks are started right away and the returned async generator yields each page as it is done.
+#As in github_scraper.iter_repo_pages the incremental crawl takes the repos not pushed to since they were stored from the store.
+def iter_repo_pages(urls, pushed_dates=None):
+    semaphore = asyncio.Semaphore(github_scraper.ENRICH_WORKERS)
+
+    async def bounded_scrape(url):
+        async with semaphore:
+            return await scrape_repo_page(url)
+
+    stored_pages = scrape_store.stored_repo_pages(urls, pushed_dates)
+    tasks = [asyncio.ensure_future(bounded_scrape(url)) for url, stored_page in zip(urls, stored_pages) if stored_page is None]
+    #The loop's clock is time.monotonic(), the clock of the request's deadline
+    scraped_pages = wait_repo_pages(tasks, request_deadline.earliest(asyncio.get_running_loop().time() + github_scraper.ENRICH_TIMEOUT))
+    return scrape_store.merge_repo_pages_async(urls, pushed_dates, stored_pages, scraped_pages)
+
+async def wait_repo_pages(tasks, deadline):
+    loop = asyncio.get_running_loop()
+    for task in tasks:
+        if not task.done():
+            await asyncio.wait([task], timeout=max(0, deadline - loop.time()))
+
+        repo_page = None
+        if not task.done():
+            #A task cancelled while it is about to give up on the deadline ends with DeadlineExceeded instead
+            task.cancel()
+            task.add_done_callback(discard_outcome)
+        elif not task.cancelled() and task.exception() is None:
+            repo_page = task.result()
+        elif not task.cancelled() and isinstance(task.exception(), rate_limit.UpstreamBusy):
+            raise task.exception()
+
+        if repo_page is None:
+            repo_page = github_scraper.unavailable_repo_page()
+        yield repo_page
+
+#Retrieves the outcome of a task nobody waits for anymore, so it is not logged as never retrieved
+def discard_outcome(task):
+    if not task.cancelled():
+        task.exception()
+
+def iter_repo_pages_for_fields(layered_urls, fields, pushed_dates=None):
+    if fields is not None and not set(fields).intersection(REPO_PAGE_OUTPUT_FIELDS):
+        return scrape_cache.iterate_list([dict.fromkeys(REPO_PAGE_FIELDS) for _ in layered_urls])
+    return iter_repo_pages(layered_urls, pushed_dates)
+
+#Function for GET /users/{username}/repos for user
+@scrape_cache.cached('user_repos', serve_stale=True, cacheable=github_scraper.is_complete)
+async def scrape_user_repo(url, username, per_page, sort_by, direction, page, owner=None, fields=None):
+    repos = await iter_user_repo(url, username, per_page, sort_by, direction, page, owner, fields)
+    return [repo async for repo in repos] if repos is not None else None
+
+async def stream_user_repo(url, username, per_page, sort_by, direction, page, owner=None, fields=None):
+    return await scrape_user_repo.stream(iter_user_repo, url, username, per_page, sort_by, direction, page, owner, fields)
+
+#See github_scraper.iter_user_repo, returns None or an async generator of the repos
+async def iter_user_repo(url, username, per_page, sort_by, direction, page, owner=None, fields=None):
+    page_repos_list, listing = await scrape_listing(url, USER_REPO_ROW, per_page, sort_by, direction, page)
+    if listing is None:
+        return None
+    if owner is None:
+        owner = github_scraper.listing_owner(listing, username)
+
+    repo_pages = iter_repo_pages_for_fields(github_scraper.listing_layered_urls(page_repos_list), fields, github_scraper.listing_pushed_dates(page_repos_list))
+    return build_repos(page_repos_list, repo_pages, lambda row, repo_page: github_scraper.build_user_repo(row, repo_page, owner), fields)
+
+#Function for GET /users/{username}/repos for organisations
+@scrape_cache.cached('org_repos', serve_stale=True, cacheable=github_scraper.is_complete)
+async def scrape_org_repo(url, username, per_page, sort_by, direction, page, fields=None):
+    repos = await iter_org_repo(url, username, per_page, sort_by, direction, page, fields)
+    return [repo async for repo in repos] if repos is not None else None
+
+async def stream_org_repo(url, username, per_page, sort_by, direction, page, fields=None):
+    return await scrape_org_repo.stream(iter_org_repo, url, username, per_page, sort_by, direction, page, fields)
+
+async def iter_org_repo(url, username, per_page, sort_by, direction, page, fields=None):
+    page_repos_list, listing = await scrape_listing(url, ORG_REPO_ROW, per_page, sort_by, direction, page)
+    if listing is None:
+        return None
+
+    repo_pages = iter_repo_pages_for_fields(github_scraper.listing_layered_urls(page_repos_list), fields, github_scraper.listing_pushed_dates(page_repos_list))
+    return build_repos(page_repos_list, repo_pages, github_scraper.build_org_repo, fields)
+
+async def build_repos(page_repos_list, repo_pages, build_repo, fields):
+    for row in page_repos_list:
+        repo_page = await repo_pages.__anext__()
+        yield github_scraper.mark_unavailable(github_scraper.select_fields(build_repo(row, repo_page), fields), repo_page)
+
+#Iterates an async iterator of this module (e.g. the result of stream_user_repo) from a thread outside of the engine
+def iterate_sync(items):
+    while True:
+        try:
+            yield run_sync(next_item(items))
+        except StopAsyncIteration:
+            return
+
+async def next_item(items):
+    return await items.__anext__()
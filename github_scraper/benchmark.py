@@ -0,0 +1,471 @@
+import argparse
+import concurrent.futures
+import io
+import json
+import os
+import platform
+import statistics
+import threading
+import time
+import tracemalloc
+import requests
+import urllib3
+from requests.structures import CaseInsensitiveDict
+import github_scraper
+import http_client
+import metrics
+import parse_pool
+import scrape_cache
+import rate_limit
+from fixture_server import FixtureServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+#Transport adapter serving pages from the saved HTML fixtures instead of github.com, counting every upstream request.
+#latency (in seconds) is slept on every request to stand in for the round-trip to github.com.
+class FixtureReplay(requests.adapters.BaseAdapter):
+    def __init__(self, fixtures_dir=FIXTURES_DIR, latency=0):
+        super().__init__()
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        with open(os.path.join(fixtures_dir, 'index.json')) as f:
+            self.index = json.load(f)
+        self.pages = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        url = request.url
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        response = requests.models.Response()
+        response.url = url
+        response.request = request
+        if url in self.index:
+            file_name = self.index[url]
+            if file_name not in self.pages:
+                with open(os.path.join(self.fixtures_dir, file_name), 'rb') as f:
+                    self.pages[file_name] = f.read()
+            response.status_code = 200
+            content = self.pages[file_name]
+        else:
+            response.status_code = 404
+            content = b'Not Found'
+        response.headers = CaseInsensitiveDict({'Content-Type': 'text/html; charset=utf-8', 'Content-Length': str(len(content))})
+        #The body is read from raw as from a connection, so a streamed request can stop early
+        response.raw = urllib3.HTTPResponse(body=io.BytesIO(content), headers=response.headers, status=response.status_code, preload_content=False)
+        return response
+
+    def close(self):
+        pass
+
+    #Replaces the transport underneath get_with_backoff, so retries and the per-host cap stay in the path
+    def install(self):
+        http_client.set_adapter(self)
+
+#Old path: every repo goes through the nine per-field functions, each downloading the repo page again
+def enrich_per_field(repo_urls):
+    for url in repo_urls:
+        github_scraper.scrape_repo_id(url)
+        github_scraper.scrape_repo_fork(url)
+        github_scraper.scrape_repo_homepage(url)
+        github_scraper.scrape_repo_forks_count(url)
+        github_scraper.scrape_repo_stargazers_count(url)
+        github_scraper.scrape_repo_default_branch(url)
+        github_scraper.scrape_repo_open_issues_count(url)
+        github_scraper.scrape_repo_has_projects(url)
+        github_scraper.scrape_repo_discussions(url)
+
+#New path: one download and one parse per repo
+def enrich_single_fetch(repo_urls):
+    for url in repo_urls:
+        github_scraper.scrape_repo_page(url)
+
+def run_case(replay, name, function, *args, rounds=3):
+    timings = []
+    for _ in range(rounds):
+        replay.requests = 0
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return {"case": name, "upstream_requests": replay.requests, "best_seconds": round(min(timings), 4)}
+
+def bench_repo_page(replay, per_page, rounds):
+    repo_urls = sorted(url for url, file_name in replay.index.items() if file_name == 'repo_page.html')[:per_page]
+    results = [
+        run_case(replay, 'per_field', enrich_per_field, repo_urls, rounds=rounds),
+        run_case(replay, 'single_fetch', enrich_single_fetch, repo_urls, rounds=rounds),
+        run_case(replay, 'scrape_user_repo', github_scraper.scrape_user_repo, 'https://github.com/octocat?tab=repositories', 'octocat', per_page, 'full_name', 'asc', 1, rounds=rounds),
+    ]
+    return results
+
+#Sequential against concurrent 2nd layer scraping of one listing page
+def bench_enrichment(replay, per_page, rounds):
+    results = []
+    for workers in [1, github_scraper.ENRICH_WORKERS]:
+        github_scraper._enrich_executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        github_scraper._enrich_executor_pid = os.getpid()
+        result = run_case(replay, 'scrape_user_repo', github_scraper.scrape_user_repo, 'https://github.com/octocat?tab=repositories', 'octocat', per_page, 'full_name', 'asc', 1, rounds=rounds)
+        result['workers'] = workers
+        results.append(result)
+    return results
+
+#Cold against warm scrape_user_repo with the in-process cache
+def bench_cache(replay, per_page, rounds):
+    scrape_cache.set_backend(scrape_cache.MemoryBackend())
+    results = []
+    for name in ['cold', 'warm']:
+        result = run_case(replay, 'scrape_user_repo', github_scraper.scrape_user_repo, 'https://github.com/octocat?tab=repositories', 'octocat', per_page, 'full_name', 'asc', 1, rounds=1)
+        result['cache'] = name
+        results.append(result)
+    results.append(scrape_cache.cache_stats())
+    return results
+
+#Per-page parse time and peak memory of every installed parser backend, with and without the extractors' strainers
+PARSE_CASES = [
+    ('user_profile.html', github_scraper.extract_profile, ('https://github.com/octocat', 'octocat')),
+    ('org_profile.html', github_scraper.extract_profile, ('https://github.com/github', 'github')),
+    ('repo_page.html', github_scraper.extract_repo_page, ()),
+]
+
+def bench_parse(replay, per_page, rounds):
+    results = []
+    for parser in ['html.parser', 'lxml', 'html5lib']:
+        try:
+            github_scraper.BeautifulSoup('', parser)
+        except github_scraper.FeatureNotFound:
+            continue
+        github_scraper.HTML_PARSER = parser
+        for strainers in ([False] if parser == 'html5lib' else [False, True]):
+            github_scraper.USE_STRAINERS = strainers
+            for file_name, extractor, args in PARSE_CASES:
+                with open(os.path.join(replay.fixtures_dir, file_name), 'rb') as f:
+                    content = f.read()
+                parse_only = getattr(extractor, 'parse_only', None)
+
+                timings = []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    extractor(github_scraper.make_soup(content, parse_only), *args)
+                    timings.append(time.perf_counter() - start)
+
+                tracemalloc.start()
+                extractor(github_scraper.make_soup(content, parse_only), *args)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                results.append({"case": "parse", "page": file_name, "parser": parser, "strainer": strainers, "best_ms": round(min(timings) * 1000, 2), "peak_kib": round(peak / 1024)})
+    return results
+
+#Old path: one full-tree soup.find() per row of an extraction plan, as the profile fields were read before the plans
+def find_fields(plan, soup, **params):
+    fields = {}
+    for field, selector, getter in zip(plan.fields, plan.selectors, plan.getters):
+        attrs = {}
+        for attr, wanted in selector.bind(params).items():
+            #soup.find() also calls a predicate for the tags without the attribute
+            attrs[attr] = (lambda value, wanted=wanted: value is not None and wanted(value)) if callable(wanted) else wanted
+        tag = soup.find(selector.name, attrs=attrs, class_=selector.class_) if selector.class_ is not None else soup.find(selector.name, attrs=attrs)
+        fields[field] = getter(tag) if tag is not None else None
+    return fields
+
+#Per-profile cost of reading the profile fields from an already built soup (the parse is not included), with one find()
+#per field against the single walk of the extraction plan, with and without the strainer the profile extractor declares.
+#same_fields tells whether both read the same values.
+PROFILE_CASES = [
+    ('scrape_person_user', 'user_profile.html', github_scraper.PERSON_PROFILE_PLAN, {"username": 'octocat'}),
+    ('scrape_org_user', 'org_profile.html', github_scraper.ORG_PROFILE_PLAN, {}),
+]
+
+def bench_profile(replay, per_page, rounds):
+    results = []
+    for strainers in [False, True]:
+        github_scraper.USE_STRAINERS = strainers
+        for name, file_name, plan, params in PROFILE_CASES:
+            with open(os.path.join(replay.fixtures_dir, file_name), 'rb') as f:
+                soup = github_scraper.make_soup(f.read(), github_scraper.extract_profile.parse_only)
+            expected = plan.evaluate(soup, **params)
+            for extraction, read_fields in [('find', lambda: find_fields(plan, soup, **params)), ('plan', lambda: plan.evaluate(soup, **params))]:
+                timings = []
+                for _ in range(max(rounds, 20)):
+                    start = time.perf_counter()
+                    fields = read_fields()
+                    timings.append(time.perf_counter() - start)
+                results.append({"case": name, "extraction": extraction, "strainer": strainers, "best_ms": round(min(timings) * 1000, 3),
+                                "median_ms": round(statistics.median(timings) * 1000, 3), "same_fields": fields == expected})
+    return results
+
+#Full against streaming fetch (GITHUB_SCRAPER_STREAM_FETCH) of the repo pages: bytes downloaded and saved per page, time,
+#and whether the fields read from the page prefixes are the same
+def bench_stream_fetch(replay, per_page, rounds):
+    repo_urls = sorted(url.replace('https://github.com', github_scraper.GITHUB_URL, 1) for url, file_name in replay.index.items() if file_name == 'repo_page.html')[:per_page]
+    results = []
+    full_pages = None
+    for streaming in [False, True]:
+        github_scraper.STREAM_FETCH = streaming
+        timings = []
+        for _ in range(rounds):
+            requests_before = http_client.pool_stats()["requests"]
+            downloaded_before = metrics.counter('github_scraper_upstream_bytes_total')
+            saved_before = metrics.counter('github_scraper_upstream_bytes_saved_total')
+            start = time.perf_counter()
+            pages = [github_scraper.scrape_repo_page(url) for url in repo_urls]
+            timings.append(time.perf_counter() - start)
+            upstream_requests = http_client.pool_stats()["requests"] - requests_before
+            downloaded = metrics.counter('github_scraper_upstream_bytes_total') - downloaded_before
+            saved = metrics.counter('github_scraper_upstream_bytes_saved_total') - saved_before
+        if full_pages is None:
+            full_pages = pages
+        results.append({"case": "stream_fetch", "streaming": streaming, "upstream_requests": upstream_requests, "bytes_per_page": round(downloaded / len(repo_urls)),
+                        "saved_per_page": round(saved / len(repo_urls)), "best_ms_per_page": round(min(timings) / len(repo_urls) * 1000, 3), "same_fields": pages == full_pages})
+    return results
+
+#Parse throughput of the PARSE_CASES pages against the size of the parse pool (0 parses inline), with calls parses
+#spread over concurrency threads as the worker pool would. The pool is started before it is timed.
+def bench_parse_pool(replay, per_page, rounds, concurrency=8, calls=50):
+    pages = []
+    for file_name, extractor, args in PARSE_CASES:
+        with open(os.path.join(replay.fixtures_dir, file_name), 'rb') as f:
+            pages.append((f.read(), extractor, args))
+    cores = os.cpu_count() or 1
+    sizes = [0] + sorted({min(2 ** power, cores) for power in range(cores.bit_length() + 1)})
+    parse_pool.PARSE_INLINE_BYTES = 0
+    results = []
+    inline_rate = None
+    for processes in sizes:
+        parse_pool.PARSE_PROCESSES = processes
+        if processes:
+            executor = parse_pool.get_parse_executor()
+            concurrent.futures.wait([executor.submit(parse_pool.parse_and_extract, content, github_scraper.HTML_PARSER, None, extractor, args) for content, extractor, args in pages * processes])
+
+        def parse(index):
+            content, extractor, args = pages[index % len(pages)]
+            github_scraper.extract_page(content, extractor, *args)
+
+        rates = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(parse, range(calls)))
+            rates.append(calls / (time.perf_counter() - start))
+        if processes:
+            parse_pool.reset_parse_executor(parse_pool.get_parse_executor())
+        rate = max(rates)
+        inline_rate = inline_rate or rate
+        results.append({"case": "parse_pool", "processes": processes, "cores": cores, "concurrency": concurrency, "calls": calls,
+                        "parses_per_sec": round(rate, 1), "speedup": round(rate / inline_rate, 2)})
+    return results
+
+#Memory still allocated when the repo pages of a listing start being scraped, i.e. what the listing holds during them
+_held_bytes = []
+
+def held_at_enrichment(iter_repo_pages_for_fields):
+    def wrapper(*args, **kwargs):
+        if tracemalloc.is_tracing():
+            _held_bytes.append(tracemalloc.get_traced_memory()[0])
+        return iter_repo_pages_for_fields(*args, **kwargs)
+    return wrapper
+
+#Peak memory, memory held during the repo pages and latency of one repo listing call, for the orders read from the start
+#and from the end of GitHub's listing. The result cache is off, so every call crawls again.
+def bench_listing(replay, per_page, rounds):
+    github_scraper.iter_repo_pages_for_fields = held_at_enrichment(github_scraper.iter_repo_pages_for_fields)
+    base = github_scraper.GITHUB_URL
+    results = []
+    for name, function, args in [
+        ('scrape_user_repo', github_scraper.scrape_user_repo.uncached, (f'{base}/octocat?tab=repositories', 'octocat')),
+        ('scrape_org_repo', github_scraper.scrape_org_repo.uncached, (f'{base}/orgs/github/repositories', 'github')),
+    ]:
+        for sort_by, direction in [('full_name', 'asc'), ('pushed', 'asc')]:
+            call_args = args + (per_page, sort_by, direction, 1)
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                function(*call_args)
+                timings.append(time.perf_counter() - start)
+            _held_bytes.clear()
+            tracemalloc.start()
+            function(*call_args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results.append({"case": name, "sort": sort_by, "direction": direction, "best_ms": round(min(timings) * 1000, 2), "peak_kib": round(peak / 1024),
+                            "held_kib": round(max(_held_bytes, default=0) / 1024)})
+    return results
+
+#Memory and encoding time of count repos (1k to 100k, copies of one scraped listing page) as the dicts a scrape returns
+#and as the records (records.py) the memory cache keeps, encoded for a response with json and with orjson (when
+#installed). The records are turned back into dicts first, as for a cache hit. Every encoder gives the same bytes.
+def bench_serialize(replay, per_page, rounds):
+    import github_api
+    import records
+    base = github_scraper.GITHUB_URL
+    repos = github_scraper.scrape_user_repo.uncached(f'{base}/octocat?tab=repositories', 'octocat', per_page, 'full_name', 'asc', 1)
+    provider = github_api.app.json
+    encoders = ['json', 'orjson'] if github_api.orjson is not None else ['json']
+    results = []
+    for count in [1000, 10000, 100000]:
+        for kind in ['dict', 'record']:
+            tracemalloc.start()
+            payload = [dict(repos[index % len(repos)], owner=dict(repos[index % len(repos)]['owner'])) for index in range(count)]
+            if kind == 'record':
+                payload = records.compact(payload)
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            read = records.expand if kind == 'record' else (lambda payload: payload)
+            body = None
+            for encoder in encoders:
+                github_api.JSON_ENCODER = encoder
+                timings = []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    encoded = provider.dumps(read(payload), separators=(',', ':'))
+                    timings.append(time.perf_counter() - start)
+                body = body or encoded
+                results.append({"case": "serialize", "repos": count, "kind": kind, "encoder": encoder, "best_ms": round(min(timings) * 1000, 2),
+                                "memory_kib": round(size / 1024), "same_bytes": encoded == body})
+    return results
+
+#Seconds spent building soups, over all threads
+_parse_seconds = 0.0
+_parse_lock = threading.Lock()
+
+def timed_make_soup(make_soup):
+    def wrapper(*args, **kwargs):
+        global _parse_seconds
+        start = time.perf_counter()
+        try:
+            return make_soup(*args, **kwargs)
+        finally:
+            with _parse_lock:
+                _parse_seconds += time.perf_counter() - start
+    return wrapper
+
+def suite_cases(per_page):
+    base = github_scraper.GITHUB_URL
+    return [
+        ('scrape_person_user', github_scraper.scrape_profile.uncached, (f'{base}/octocat', 'octocat')),
+        ('scrape_org_user', github_scraper.scrape_profile.uncached, (f'{base}/github', 'github')),
+        ('scrape_user_repo', github_scraper.scrape_user_repo.uncached, (f'{base}/octocat?tab=repositories', 'octocat', per_page, 'full_name', 'asc', 1)),
+        ('scrape_org_repo', github_scraper.scrape_org_repo.uncached, (f'{base}/orgs/github/repositories', 'github', per_page, 'full_name', 'asc', 1)),
+    ]
+
+#One call of function: its latency, upstream requests and parse time (summed over the threads it used). The counters are process wide,
+#so they are only exact while no other call runs.
+def measure_call(function, args):
+    requests_before = http_client.pool_stats()["requests"]
+    parse_before = _parse_seconds
+    start = time.perf_counter()
+    function(*args)
+    latency = time.perf_counter() - start
+    return latency, http_client.pool_stats()["requests"] - requests_before, _parse_seconds - parse_before
+
+def percentile_ms(latencies, p):
+    latencies = sorted(latencies)
+    return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+#The four scrapers behind the API, without the result cache: rounds calls one at a time for the upstream requests,
+#parse time and latency of a single call, then calls calls spread over concurrency threads for throughput and tail latency
+def bench_suite(replay, per_page, rounds, concurrency=8, calls=50):
+    github_scraper.make_soup = timed_make_soup(github_scraper.make_soup)
+    results = []
+    for name, function, args in suite_cases(per_page):
+        sequential = [measure_call(function, args) for _ in range(rounds)]
+
+        def timed_call(_):
+            start = time.perf_counter()
+            function(*args)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed_call, range(calls)))
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            "case": name,
+            "upstream_requests": sequential[-1][1],
+            "parse_ms": round(statistics.median(parse for latency, requests, parse in sequential) * 1000, 2),
+            "latency_ms": round(statistics.median(latency for latency, requests, parse in sequential) * 1000, 2),
+            "concurrency": concurrency,
+            "calls": calls,
+            "throughput_cps": round(calls / elapsed, 1),
+            "p50_ms": percentile_ms(latencies, 0.50),
+            "p99_ms": percentile_ms(latencies, 0.99),
+        })
+    return results
+
+BENCHMARKS = {
+    'repo_page': bench_repo_page,
+    'enrichment': bench_enrichment,
+    'cache': bench_cache,
+    'parse': bench_parse,
+    'profile': bench_profile,
+    'stream_fetch': bench_stream_fetch,
+    'listing': bench_listing,
+    'parse_pool': bench_parse_pool,
+    'serialize': bench_serialize,
+    'suite': bench_suite,
+}
+
+#Numbers of a result that say which case it is, not how it did
+CASE_NUMBERS = ('workers', 'concurrency', 'calls', 'processes', 'cores', 'repos')
+
+def is_measure(name, value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and name not in CASE_NUMBERS
+
+#Relative change of every measure of the results against the same case of an earlier --output file
+def compare(results, baseline):
+    def key(result):
+        return tuple((name, value) for name, value in sorted(result.items()) if not is_measure(name, value))
+    baseline_results = {key(result): result for result in baseline["results"]}
+    for result in results:
+        before = baseline_results.get(key(result))
+        if before is None:
+            continue
+        changes = {}
+        for name, value in result.items():
+            if is_measure(name, value) and before.get(name):
+                changes[name] = f'{(value - before[name]) / before[name] * 100:+.1f}%'
+        yield dict(key(result), changes=changes)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the scraper against saved HTML fixtures')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser.add_argument('--per-page', type=int, default=30)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=0, help='simulated upstream round-trip time per request')
+    parser.add_argument('--concurrency', type=int, default=8, help='threads calling at once (suite, parse_pool)')
+    parser.add_argument('--calls', type=int, default=50, help='calls per case at --concurrency (suite, parse_pool)')
+    parser.add_argument('--server', action='store_true', help='replay through fixture_server.py over HTTP instead of in process (suite, stream_fetch)')
+    parser.add_argument('--output', help='also write the settings and results to this JSON file')
+    parser.add_argument('--compare', help='JSON file written by an earlier --output run to print the changes against')
+    args = parser.parse_args()
+
+    replay = FixtureReplay(args.fixtures, latency=args.latency_ms / 1000)
+    if args.server:
+        server = FixtureServer(('127.0.0.1', 0), args.fixtures, args.latency_ms / 1000).start()
+        github_scraper.GITHUB_URL = server.url
+    else:
+        replay.install()
+    #Every round must reach the (replayed) network, the cache benchmark installs its own backend
+    scrape_cache.set_backend(None)
+    #The replay is local, nothing to rate limit
+    rate_limit.set_bucket(None)
+    options = {"concurrency": args.concurrency, "calls": args.calls} if args.benchmark in ('suite', 'parse_pool') else {}
+    results = list(BENCHMARKS[args.benchmark](replay, args.per_page, args.rounds, **options))
+    for result in results:
+        print(json.dumps(result))
+
+    if args.output:
+        settings = {"per_page": args.per_page, "rounds": args.rounds, "latency_ms": args.latency_ms, "server": args.server, **options,
+                    "parser": github_scraper.HTML_PARSER, "strainers": github_scraper.USE_STRAINERS, "workers": github_scraper.ENRICH_WORKERS,
+                    "python": platform.python_version()}
+        with open(args.output, 'w') as f:
+            json.dump({"benchmark": args.benchmark, "settings": settings, "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            for change in compare(results, json.load(f)):
+                print(json.dumps(change))
@@ -0,0 +1,140 @@
+import codecs
+from html.parser import HTMLParser
+from bs4 import Tag
+
+#Declarative extraction: a table of (field, selector, getter) rows compiled once into a plan, which fills all its fields
+#in a single walk over the tree instead of one soup.find() scan per field. Every selector keeps the semantics of
+#soup.find() with the same arguments: its field gets the first matching tag in document order.
+class Selector:
+    #name: tag name. class_: one of the tag's classes or all of them as written. attrs: attribute values, each one either
+    #a string (compared exactly, {placeholders} are filled in per evaluation) or a predicate called with the value.
+    def __init__(self, name, /, class_=None, **attrs):
+        self.name = name
+        self.class_ = class_
+        self.attrs = attrs
+
+    def bind(self, params):
+        bound = {}
+        for attr, wanted in self.attrs.items():
+            bound[attr] = wanted.format(**params) if isinstance(wanted, str) and '{' in wanted else wanted
+        return bound
+
+    def matches(self, tag, bound):
+        if self.class_ is not None:
+            classes = tag.get('class')
+            if not classes or (self.class_ not in classes and ' '.join(classes) != self.class_):
+                return False
+        for attr, wanted in bound.items():
+            value = tag.get(attr)
+            if value is None:
+                return False
+            if callable(wanted):
+                if not wanted(value):
+                    return False
+            elif value != wanted:
+                return False
+        return True
+
+class ExtractionPlan:
+    def __init__(self, rows):
+        self.fields = [field for field, selector, getter in rows]
+        self.selectors = [selector for field, selector, getter in rows]
+        self.getters = [getter for field, selector, getter in rows]
+        #Selectors by tag name, so a tag is only tested against the selectors that can match it
+        self.by_name = {}
+        for field, selector, getter in rows:
+            self.by_name.setdefault(selector.name, []).append((field, selector, getter))
+
+    #Returns {field: value} for soup, a field without a matching tag is None. params fill the selectors' placeholders.
+    def evaluate(self, soup, **params):
+        pending = {name: [(field, selector, selector.bind(params), getter) for field, selector, getter in rows] for name, rows in self.by_name.items()}
+        remaining = len(self.fields)
+        values = dict.fromkeys(self.fields)
+        for node in soup.descendants:
+            if not isinstance(node, Tag):
+                continue
+            rows = pending.get(node.name)
+            if not rows:
+                continue
+            for row in list(rows):
+                field, selector, bound, getter = row
+                if selector.matches(node, bound):
+                    values[field] = getter(node)
+                    rows.remove(row)
+                    remaining -= 1
+            if not remaining:
+                break
+        return values
+
+#Getters, the value read from the matched tag
+def text(tag):
+    return tag.text.strip()
+
+def attribute(name):
+    def getter(tag):
+        return tag[name]
+    return getter
+
+#Text of the first descendant matching name (and class_), None without one
+def child_text(name, class_=None):
+    def getter(tag):
+        child = tag.find(name, class_=class_) if class_ is not None else tag.find(name)
+        return child.text.strip() if child else None
+    return getter
+
+#True when the tag is there at all
+def present(tag):
+    return True
+
+def contains(substring):
+    def predicate(value):
+        return substring in value
+    return predicate
+
+#Elements without an end tag
+VOID_ELEMENTS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'))
+
+#Follows a page as it is downloaded (feed the raw chunks) and tells when every selector of a plan has matched and its
+#element has ended. The fields of the plan then only depend on what was read so far: each one takes its first match,
+#and everything its getter reads lies inside that element.
+class PlanWatcher(HTMLParser):
+    def __init__(self, plan, encoding='utf-8', **params):
+        super().__init__(convert_charrefs=True)
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.pending = [(selector, selector.bind(params)) for selector in plan.selectors]
+        self.open = []          #[name, depth] of the matched elements not ended yet
+        self.done = not self.pending
+
+    def feed_bytes(self, chunk):
+        self.feed(self.decoder.decode(chunk))
+        return self.done
+
+    def handle_starttag(self, name, attrs):
+        self.start(name, attrs, name in VOID_ELEMENTS)
+
+    def handle_startendtag(self, name, attrs):
+        self.start(name, attrs, True)
+
+    def start(self, name, attrs, ended):
+        for element in self.open:
+            if element[0] == name and not ended:
+                element[1] += 1
+        if not self.pending:
+            return
+        #Attributes as BeautifulSoup gives them: class split into a list, a bare attribute as ''
+        tag = {attr: value if value is not None else '' for attr, value in attrs}
+        if 'class' in tag:
+            tag['class'] = tag['class'].split()
+        matched = [(selector, bound) for selector, bound in self.pending if selector.name == name and selector.matches(tag, bound)]
+        if matched:
+            self.pending = [row for row in self.pending if row not in matched]
+            if not ended:
+                self.open.append([name, 1])
+        self.done = not self.pending and not self.open
+
+    def handle_endtag(self, name):
+        for element in self.open:
+            if element[0] == name:
+                element[1] -= 1
+        self.open = [element for element in self.open if element[1] > 0]
+        self.done = not self.pending and not self.open
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+#Local stand-in for github.com serving the saved fixture pages. Point the scraper at it with
+#GITHUB_SCRAPER_GITHUB_URL=http://127.0.0.1:<port>. latency (in seconds) is slept before every answer.
+#Scripted answers (see script) make it a stub for GitHub's rate limits and outages.
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures_dir=FIXTURES_DIR, latency=0):
+        super().__init__(address, FixtureHandler)
+        self.latency = latency
+        self.pages = {}
+        with open(os.path.join(fixtures_dir, 'index.json')) as f:
+            index = json.load(f)
+        #The index is keyed by github.com urls, the server answers on their path and query
+        for url, file_name in index.items():
+            with open(os.path.join(fixtures_dir, file_name), 'rb') as f:
+                self.pages[url.replace('https://github.com', '', 1)] = f.read()
+        self.scripts = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    #Queues answers for path (a path and query, or '*' for any), each request takes the next one before the
+    #fixture page is served again: a list of (status, headers) pairs, e.g. [(429, {"Retry-After": "1"}), (502, {})].
+    #The status 'truncated' sends the page as a 200 cut off half way, like a connection dropped in the middle of a body.
+    def script(self, path, responses):
+        with self.lock:
+            self.scripts.setdefault(path, []).extend(responses)
+
+    def next_scripted(self, path):
+        with self.lock:
+            for key in (path, '*'):
+                if self.scripts.get(key):
+                    return self.scripts[key].pop(0)
+        return None
+
+    #Clients dropping the connection in the middle of a page (the streaming fetch) are expected
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'      #Keep-alive, like github.com
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        scripted = self.server.next_scripted(self.path)
+        if scripted is not None and scripted[0] == 'truncated':
+            self.send_truncated(self.server.pages.get(self.path, b'Not Found'))
+            return
+        if scripted is not None:
+            status, headers = scripted
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            body = f'Scripted {status}'.encode()
+        else:
+            body = self.server.pages.get(self.path)
+            if body is None:
+                self.send_response(404)
+                body = b'Not Found'
+            else:
+                self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    #Chunked, so the client can only tell the body is incomplete when the connection closes before its last chunk
+    def send_truncated(self, body):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        part = body[:len(body) // 2]
+        self.wfile.write(f'{len(part):x}\r\n'.encode() + part + b'\r\n')
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the saved GitHub fixture pages over HTTP')
+    parser.add_argument('--port', type=int, default=8700)
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--script', help='JSON file of scripted answers: {"<path or *>": [[status, {headers}], ...]}')
+    args = parser.parse_args()
+
+    server = FixtureServer(('127.0.0.1', args.port), args.fixtures, args.latency_ms / 1000)
+    if args.script:
+        with open(args.script) as f:
+            for path, responses in json.load(f).items():
+                server.script(path, responses)
+    print(f'Serving {len(server.pages)} fixture pages on {server.url}')
+    server.serve_forever()
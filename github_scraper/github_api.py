@@ -1,21 +1,139 @@
 import os
-from flask import Flask, jsonify, request
+import re
+import time
+import functools
+from flask import Flask, Response, jsonify, request, g
+from flask.json.provider import DefaultJSONProvider
 import github_scraper
+import http_client
+import scrape_cache
+import single_flight
+import rate_limit
+import scrape_store
+import parse_pool
+import metrics
+import request_deadline
+
+#GITHUB_API_SERVER_TIMING=1 adds a Server-Timing header with the time spent in each stage of the scrape
+SERVER_TIMING = os.environ.get('GITHUB_API_SERVER_TIMING', '0') == '1'
+
+#Time budget of a request in seconds (0 for none), a client can ask for a shorter one with an X-Request-Timeout header
+DEADLINE = float(os.environ.get('GITHUB_API_DEADLINE', 0))
+
+#GITHUB_SCRAPER_ASYNC=1 scrapes with async_scraper.py (aiohttp on one event loop) instead of the thread pool
+ASYNC_ENGINE = os.environ.get('GITHUB_SCRAPER_ASYNC', '0') == '1'
+if ASYNC_ENGINE:
+    import async_scraper
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#JSON encoder of the responses: orjson (an optional dependency, `pip install orjson`) when it is installed, else json.
+#GITHUB_API_JSON=json always uses the standard library.
+JSON_ENCODER = os.environ.get('GITHUB_API_JSON', 'orjson')
+if orjson is None:
+    JSON_ENCODER = 'json'
+
+#Dates and dataclasses still go through Flask's own conversion, as with json
+ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson is not None else 0
+
+#With ensure_ascii, json escapes every character outside printable ASCII where orjson only escapes the control
+#characters: the others (non-ASCII text and DEL) can only be in strings and are escaped the same way afterwards
+UNESCAPED = re.compile('[^\x00-\x7e]')
+
+def escape(match):
+    code = ord(match.group())
+    if code > 0xffff:
+        code -= 0x10000
+        return '\\u{:04x}\\u{:04x}'.format(0xd800 | code >> 10, 0xdc00 | code & 0x3ff)
+    return '\\u{:04x}'.format(code)
+
+#Encodes response bodies with orjson: sorted keys and compact separators, as Flask sends them, with the same escapes as
+#json. The bytes are those of json, except for floats in exponent notation (e.g. 1e-05 is written 0.00001), which only
+#/stats can have. A body orjson can not encode (e.g. an integer over 64 bits) falls back to json, as do the other dumps
+#(e.g. the NDJSON lines).
+class ScraperJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        if JSON_ENCODER == 'orjson' and kwargs == {"separators": (',', ':')} and self.sort_keys and self.ensure_ascii:
+            try:
+                encoded = orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode()
+            except orjson.JSONEncodeError:
+                return super().dumps(obj, **kwargs)
+            if not encoded.isascii() or '\x7f' in encoded:
+                encoded = UNESCAPED.sub(escape, encoded)
+            return encoded
+        return super().dumps(obj, **kwargs)
 
 app = Flask(__name__)
+app.json = ScraperJSONProvider(app)
+
+#The views await the scrape functions of the selected engine. With the asyncio engine they are registered as async
+#views, otherwise nothing they await ever suspends, so they are registered as plain views running their coroutine to
+#the end in one step, without the event loop (and thread) Flask starts for an async view.
+def route(rule, **options):
+    def decorator(view):
+        if ASYNC_ENGINE:
+            return app.route(rule, **options)(view)
+        @functools.wraps(view)
+        def sync_view(*args, **kwargs):
+            return run_inline(view(*args, **kwargs))
+        return app.route(rule, **options)(sync_view)
+    return decorator
 
-@app.route('/users/<username>', methods =['GET'])
-def get_user(username):  
-    url_scrape = f'https://github.com/{username}'
-    user_data = github_scraper.scrape_github_users_endpoint(url_scrape,username)
-    if user_data is not None:
-        return jsonify(user_data)
+def run_inline(coro):
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError('A view suspended without the asyncio engine')
+
+#Calls the scrape function of that name on the selected engine
+async def scrape(name, *args):
+    if ASYNC_ENGINE:
+        return await async_scraper.run(getattr(async_scraper, name)(*args))
+    return getattr(github_scraper, name)(*args)
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+#Whether the request asks for the NDJSON stream (?stream=1 or Accept: application/x-ndjson) of an endpoint having one
+def wants_stream():
+    return request.args.get('stream') == '1' or request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+#Sends the items of a streaming scrape (see scrape_cache.cached) as newline delimited JSON, each one as soon as it is
+#scraped, after convert when given. The first one is waited for before the response starts, so a failing scrape still
+#gets its error status.
+async def stream_response(name, *args, convert=None):
+    if ASYNC_ENGINE:
+        items = await async_scraper.run(getattr(async_scraper, name)(*args))
+        items = async_scraper.iterate_sync(items) if items is not None else iter(())
+    else:
+        items = getattr(github_scraper, name)(*args) or iter(())
+    if convert is not None:
+        items = map(convert, items)
+    first = next(items, None)
+
+    def lines():
+        if first is not None:
+            yield app.json.dumps(first) + '\n'
+            for item in items:
+                yield app.json.dumps(item) + '\n'
+    return Response(lines(), mimetype=NDJSON_MIMETYPE)
+
+@route('/users/<username>', methods =['GET'])
+async def get_user(username):  
+    url_scrape = f'{github_scraper.GITHUB_URL}/{username}'
+    profile = await scrape('scrape_profile', url_scrape, username)
+    if profile is not None:
+        return jsonify(profile["user"])
     else:
         error_return = {"message": "Not Found", "documentation_url" : "https://docs.github.com/rest/users/users#get-a-user"}
         return jsonify(error_return), 404
 
-@app.route('/users/<username>/repos', methods=['GET'])
-def get_user_repos(username): 
+@route('/users/<username>/repos', methods=['GET'])
+async def get_user_repos(username): 
     per_page = int(request.args.get('per_page', 30))    # According to API: default to 30 repos
 
     # Default to sorting by full_name
@@ -23,6 +141,10 @@ def get_user_repos(username):
 
     page = int(request.args.get('page', 1))  # According to API: default to 1
 
+    # Pages are counted from 1, the crawl has nothing to return for page 0 or less
+    if page < 1 or per_page < 1:
+        return jsonify({"error": "Invalid page or per_page parameter."}), 400
+
     if sort_by not in ['full_name', 'pushed']:
         return jsonify({"error": "Invalid sort parameter. Use 'full_name' or 'pushed'."}), 400
 
@@ -34,25 +156,207 @@ def get_user_repos(username):
     
     if direction not in ['asc', 'desc']:
         return jsonify({"error": "Invalid direction parameter. Use 'asc' or 'desc'."}), 400
+
+    # Optional comma separated list of the repo fields to return, the repo's own page is only scraped when needed
+    fields = request.args.get('fields')
+    if fields is not None:
+        fields = tuple(sorted(set(field.strip() for field in fields.split(',') if field.strip())))
+        valid_fields = github_scraper.REPO_LISTING_OUTPUT_FIELDS + github_scraper.REPO_PAGE_OUTPUT_FIELDS
+        if not fields or not set(fields).issubset(valid_fields):
+            return jsonify({"error": f"Invalid fields parameter. Use a comma separated list of {', '.join(valid_fields)}."}), 400
     
-    #First check whether the user is a person/organisation 
-    url_type_check = f'https://github.com/{username}'
-    user_type = github_scraper.check_user_type(url_type_check)
-    if user_type is not None:
+    # Streaming mode (not part of the GitHub API): one repo per line, sent as soon as it is scraped
+    stream = wants_stream()
+
+    #First check whether the user is a person/organisation, the profile is shared with GET /users/{username}
+    url_profile = f'{github_scraper.GITHUB_URL}/{username}'
+    profile = await scrape('scrape_account', url_profile, username)
+    if profile is not None:
+        user_type = profile["type"]
         #If the user is a person
         if user_type == 1:
-            url_scrape = f'https://github.com/{username}?tab=repositories'
-            repo_data = github_scraper.scrape_user_repo(url_scrape,username,per_page,sort_by,direction,page)
+            url_scrape = f'{github_scraper.GITHUB_URL}/{username}?tab=repositories'
+            scrape_name, scrape_args = 'user_repo', (url_scrape, username, per_page, sort_by, direction, page, profile["owner"], fields)
         #If the user is an organisation
         elif user_type == 0:
-            url_scrape = f'https://github.com/orgs/{username}/repositories'
-            repo_data = github_scraper.scrape_org_repo(url_scrape,username,per_page,sort_by,direction,page)
-        
-        return jsonify(repo_data)
+            url_scrape = f'{github_scraper.GITHUB_URL}/orgs/{username}/repositories'
+            scrape_name, scrape_args = 'org_repo', (url_scrape, username, per_page, sort_by, direction, page, fields)
+
+        if stream:
+            return await stream_response(f'stream_{scrape_name}', *scrape_args)
+        repo_data = await scrape(f'scrape_{scrape_name}', *scrape_args)
+        #The profile exists but GitHub did not answer its listing with a 200
+        if repo_data is None:
+            error_return = {"message": "Not Found", "documentation_url" : "https://docs.github.com/rest/repos/repos#list-repositories-for-a-user"}
+            return jsonify(error_return), 404
+        response = jsonify(repo_data)
+        #Repos whose own page was not scraped in time (or failed) list their unavailable_fields
+        unavailable = sum(1 for repo in repo_data if 'unavailable_fields' in repo)
+        if unavailable:
+            response.headers['X-Partial-Result'] = f'unavailable={unavailable}; total={len(repo_data)}'
+        return response
     else:
         error_return = {"message": "Not Found", "documentation_url" : "https://docs.github.com/rest/users/users#get-a-user"}
         return jsonify(error_return), 404
 
+#Settings of POST /users:batch, configurable through the environment
+BATCH_MAX = int(os.environ.get('GITHUB_API_BATCH_MAX', 10000))              #Most logins accepted in one call
+BATCH_PAGE_SIZE = int(os.environ.get('GITHUB_API_BATCH_PAGE_SIZE', 100))    #Default number of logins resolved per page
+
+#Result of one login of a batch: the user as GET /users/{username} returns it, or the error that call would have returned
+def batch_result(login, profile):
+    if isinstance(profile, rate_limit.UpstreamBusy):
+        return {"login": login, "status": profile.status, "message": str(profile), "retry_after": profile.retry_after}
+    if isinstance(profile, request_deadline.DeadlineExceeded):
+        return {"login": login, "status": 504, "message": str(profile)}
+    if isinstance(profile, Exception):
+        return {"login": login, "status": 502, "message": f'Scraping GitHub failed: {profile}'}
+    if profile is None:
+        return {"login": login, "status": 404, "message": "Not Found", "documentation_url": "https://docs.github.com/rest/users/users#get-a-user"}
+    return {"login": login, "status": 200, "user": profile["user"]}
+
+#Bulk lookup of users (not part of the GitHub API): the body is {"logins": [...]}, repeated logins are resolved once.
+#The profiles are scraped concurrently (see github_scraper.stream_profiles) and the answer maps every login to its result,
+#a page of per_page logins at a time (page and per_page query parameters, the answer has the next_page).
+#With ?stream=1 or Accept: application/x-ndjson every result of the page is sent as one line as soon as it is known.
+@route('/users:batch', methods=['POST'])
+async def batch_users():
+    body = request.get_json(silent=True)
+    logins = body.get('logins') if isinstance(body, dict) else body
+    if not isinstance(logins, list) or not all(isinstance(login, str) for login in logins):
+        return jsonify({"error": "Invalid body. Send {\"logins\": [\"login\", ...]}."}), 400
+    #GitHub logins are case-insensitive, a login repeated in another case is resolved once, with its first spelling
+    unique_logins = {}
+    for login in logins:
+        unique_logins.setdefault(login.strip().lower(), login.strip())
+    logins = list(unique_logins.values())
+    if len(logins) > BATCH_MAX:
+        return jsonify({"error": f"Too many logins. Send at most {BATCH_MAX} per call."}), 400
+
+    stream = wants_stream()
+    page = int(request.args.get('page', 1))
+    per_page = int(request.args.get('per_page', max(len(logins), 1) if stream else BATCH_PAGE_SIZE))
+    if page < 1 or per_page < 1:
+        return jsonify({"error": "Invalid page or per_page parameter."}), 400
+    page_logins = logins[(page - 1) * per_page:page * per_page]
+
+    if stream:
+        return await stream_response('stream_profiles', page_logins, convert=lambda result: batch_result(*result))
+
+    results = await scrape('scrape_profiles', page_logins)
+    return jsonify({
+        "users": {login: batch_result(login, profile) for login, profile in results},
+        "total": len(logins),
+        "page": page,
+        "per_page": per_page,
+        "next_page": page + 1 if page * per_page < len(logins) else None,
+    })
+
+#Backpressure: when GitHub is rate limiting us, or too many requests are queued for it, the API answers at once
+#with 429/503 and a Retry-After instead of keeping the request thread waiting
+@app.errorhandler(rate_limit.UpstreamBusy)
+def upstream_busy(error):
+    error_return = {"message": str(error), "documentation_url": "https://docs.github.com/rest/using-the-rest-api/rate-limits-for-the-rest-api"}
+    response = jsonify(error_return)
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+#Nothing could be scraped within the request's deadline
+@app.errorhandler(request_deadline.DeadlineExceeded)
+def deadline_exceeded(error):
+    return jsonify({"message": str(error)}), 504
+
+#Budget of the request, the configured one or the shorter one the client asks for
+@app.before_request
+def start_deadline():
+    budget = DEADLINE or None
+    asked = request.headers.get('X-Request-Timeout', type=float)
+    if asked is not None and asked > 0:
+        budget = min(budget, asked) if budget is not None else asked
+    request_deadline.start(budget)
+
+#Results of the scrape may come from the cache, possibly stale (see scrape_cache.serve_cached):
+#the Age header tells the client how many seconds old the oldest of them is
+@app.before_request
+def track_age():
+    g.served = scrape_cache.track_age()
+
+@app.after_request
+def add_age(response):
+    served = g.get('served')
+    if served is not None and served["age"] is not None:
+        response.headers['Age'] = str(int(served["age"]))
+    return response
+
+#Spans of the scrape stages run for the request (see metrics.py), and its own duration per endpoint and status
+@app.before_request
+def track_spans():
+    g.spans = metrics.track_spans()
+    g.started = time.perf_counter()
+
+@app.after_request
+def add_server_timing(response):
+    spans = g.get('spans')
+    if spans is None:
+        return response
+    elapsed = time.perf_counter() - g.started
+    metrics.observe('github_api_request_seconds', elapsed, endpoint=request.endpoint or 'none', status=str(response.status_code))
+    #A streamed body is still being scraped when the headers are sent
+    if SERVER_TIMING and not response.is_streamed:
+        timings = spans.server_timing()
+        response.headers['Server-Timing'] = f'{timings + ", " if timings else ""}total;dur={elapsed * 1000:.1f}'
+    return response
+
+#Every successful GET carries an ETag of its body, a client sending it back in If-None-Match gets an empty 304 instead.
+#The ETags of complete user and repo answers are kept (see scrape_cache.get_response_etag), so a matching If-None-Match
+#within the TTL of the endpoint's cached results is answered before anything is scraped or encoded.
+ETAG_ENDPOINTS = {
+    "get_user": ('profile',),
+    "get_user_repos": ('profile', 'user_repos', 'org_repos'),
+}
+#Endpoints answering JSON or NDJSON depending on the Accept header
+STREAM_ENDPOINTS = ('get_user_repos', 'batch_users')
+
+@app.after_request
+def add_etag(response):
+    if request.method == 'GET' and response.status_code == 200 and not response.is_streamed:
+        response.add_etag()
+        if request.endpoint in ETAG_ENDPOINTS and 'X-Partial-Result' not in response.headers:
+            served = g.get('served')
+            scrape_cache.set_response_etag(request.full_path, response.get_etag()[0], served["age"] if served is not None else None)
+        response.make_conditional(request)
+    if request.endpoint in STREAM_ENDPOINTS:
+        response.vary.add('Accept')
+    return response
+
+#Registered after the other before_request hooks, so an early 304 still gets its deadline, spans and timing. The stored
+#ETag is the one of the JSON body, a request for the NDJSON stream (which has none) is never answered from it.
+@app.before_request
+def check_etag():
+    endpoints = ETAG_ENDPOINTS.get(request.endpoint)
+    if request.method != 'GET' or endpoints is None or not request.if_none_match or wants_stream():
+        return None
+    etag = scrape_cache.get_response_etag(request.full_path, min(scrape_cache.endpoint_ttl(endpoint) for endpoint in endpoints))
+    if etag is not None and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+def scraper_stats():
+    return {"http_pool": http_client.pool_stats(), "cache": scrape_cache.cache_stats(), "single_flight": single_flight.flight_stats(), "rate_limit": rate_limit.rate_limit_stats(), "store": scrape_store.store_stats(), "parse": parse_pool.parse_stats()}
+
+#Internal counters of the scraper (not part of the GitHub API)
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    return jsonify(scraper_stats())
+
+#The stage timings and upstream counters, with the counters of /stats, in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.exposition(scraper_stats()), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     port = int(os.environ.get('GITHUB_API_PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -1,678 +1,937 @@
+import os
+import re
+import json
+import threading
+import contextvars
+import time
+import concurrent.futures
+from collections import deque, namedtuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import requests
-from bs4 import BeautifulSoup
-import backoff
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+from bs4 import FeatureNotFound
+import http_client
+import scrape_cache
+import scrape_store
+import metrics
+import request_deadline
+import parse_pool
+from extraction_plan import ExtractionPlan, PlanWatcher, Selector, text, attribute, child_text, contains, present
+import rate_limit
+
+#Site the pages are scraped from, only changed to point the scraper at a local fixture server
+GITHUB_URL = os.environ.get('GITHUB_SCRAPER_GITHUB_URL', 'https://github.com')
+
+#Concurrency of the 2nd layer (per-repo page) scraping, configurable through the environment
+ENRICH_WORKERS = int(os.environ.get('GITHUB_SCRAPER_WORKERS', 8))              #Size of the shared worker pool
+HOST_CONCURRENCY = int(os.environ.get('GITHUB_SCRAPER_HOST_CONCURRENCY', 6))   #Politeness cap: max requests in flight per host
+ENRICH_TIMEOUT = float(os.environ.get('GITHUB_SCRAPER_ENRICH_TIMEOUT', 60))    #Seconds to wait for the repo pages of one listing page
+
+#HTML parser used by BeautifulSoup: html.parser (default, no extra dependency), lxml or html5lib when installed
+HTML_PARSER = os.environ.get('GITHUB_SCRAPER_PARSER', 'html.parser')
+#Extractors declaring a SoupStrainer only get the subtrees they read built, set to 0 to always build the full tree
+USE_STRAINERS = os.environ.get('GITHUB_SCRAPER_STRAINERS', '1') != '0'
+#Streaming fetch: pages of extractors declaring a stop_plan are only downloaded until all its fields are read
+STREAM_FETCH = os.environ.get('GITHUB_SCRAPER_STREAM_FETCH', '0') == '1'
+STREAM_CHUNK = int(os.environ.get('GITHUB_SCRAPER_STREAM_CHUNK', 16384))       #Bytes read from the connection at a time
+
+try:
+    BeautifulSoup('', HTML_PARSER)
+except FeatureNotFound:
+    HTML_PARSER = 'html.parser'
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+_enrich_executor = None
+_enrich_executor_pid = None
+_enrich_executor_lock = threading.Lock()
+
+#Returns the semaphore limiting the number of concurrent requests sent to the host of url
+def host_slot(url):
+    host = urlsplit(url).netloc
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return _host_slots[host]
+
+#Wrapper function for the shared, pooled HTTP client going through the outbound scheduler (rate_limit.py):
+#every attempt waits for a token, only transient errors are retried (with jittered back-off) and a rate limit
+#answer pauses all requests for its Retry-After. Raises rate_limit.UpstreamBusy instead of queueing for long.
+#With stop_plan, a successful answer is only read until the plan's fields are in it (see read_page_prefix).
+def get_with_backoff(url, stop_plan=None, **kwargs):
+    attempt = 1
+    while True:
+        wait = rate_limit.acquire()
+        request_deadline.check(wait)
+        metrics.record_wait(wait)
+        time.sleep(wait)
+        try:
+            with host_slot(url), metrics.span('upstream'):
+                #Within the request's deadline (request_deadline.py), when it has one
+                request_deadline.check()
+                timeout = (request_deadline.bounded(http_client.CONNECT_TIMEOUT), request_deadline.bounded(http_client.READ_TIMEOUT))
+                if stop_plan is None:
+                    response = http_client.get(url, timeout=timeout, **kwargs)
+                else:
+                    response = http_client.get(url, stream=True, timeout=timeout, **kwargs)
+                    read_page_prefix(response, stop_plan)
+                metrics.count_upstream(response.status_code, response.content)
+        #A body cut off in the middle (ChunkedEncodingError) is retried too, as aiohttp's ClientPayloadError is by the asyncio engine
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError):
+            metrics.count_upstream('error', b'')
+            delay = rate_limit.error_retry_delay(attempt)
+            if delay is None:
+                raise
+        else:
+            delay = rate_limit.response_retry_delay(attempt, response.status_code, response.headers)
+            if delay is None:
+                response.raise_for_status()
+                return response
+        request_deadline.check(delay)
+        rate_limit.retried()
+        metrics.count_retry()
+        metrics.record_wait(delay)
+        time.sleep(delay)
+        attempt += 1
+
+#Reads the body of a 200 answer until every field of stop_plan is in it (extraction_plan.PlanWatcher), then closes the
+#connection instead of downloading the rest. response.content is the part read, which extracts the same fields.
+def read_page_prefix(response, stop_plan):
+    if response.status_code != 200:
+        response.content
+        return
+    watcher = PlanWatcher(stop_plan)
+    chunks = []
+    for chunk in response.iter_content(STREAM_CHUNK):
+        chunks.append(chunk)
+        if watcher.feed_bytes(chunk):
+            break
+    if watcher.done:
+        length = response.headers.get('Content-Length')
+        metrics.count_truncated(int(length) if length and length.isdigit() else None, response.raw.tell())
+        response.close()
+    response._content = b''.join(chunks)
+    response._content_consumed = True
+
+#Worker pool shared by all API calls, created on first use (and again in a forked worker process, which has no threads)
+def get_enrich_executor():
+    global _enrich_executor, _enrich_executor_pid
+    with _enrich_executor_lock:
+        if _enrich_executor is None or _enrich_executor_pid != os.getpid():
+            _enrich_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ENRICH_WORKERS, thread_name_prefix='repo-enrich')
+            _enrich_executor_pid = os.getpid()
+        return _enrich_executor
+
+#Builds the soup of a page with the configured parser, limited to the tags matched by parse_only when strainers are on
+def make_soup(content, parse_only=None):
+    with metrics.span('parse'):
+        return BeautifulSoup(content, HTML_PARSER, parse_only=strained(parse_only))
+
+def strained(parse_only):
+    if not USE_STRAINERS or HTML_PARSER == 'html5lib':     #html5lib always builds the full tree
+        return None
+    return parse_only
+
+#Returns extractor(soup, *args) for the page content, parsed in the parse pool (parse_pool.py) when it is on and the page
+#is large enough, else in the calling thread. Extractors return plain values, never tags, so the soup is released as soon
+#as they are done.
+def extract_page(content, extractor, *args):
+    parse_only = getattr(extractor, 'parse_only', None)
+    if parse_pool.offloaded(content):
+        return parse_pool.extract(content, HTML_PARSER, strained(parse_only), extractor, args)
+    return extract_inline(content, extractor, *args)
+
+#Same as extract_page, always parsed in the calling thread
+def extract_inline(content, extractor, *args):
+    soup = make_soup(content, getattr(extractor, 'parse_only', None))
+    try:
+        with metrics.span(extractor.__name__):
+            return extractor(soup, *args)
+    finally:
+        release_soup(soup)
+
+#Frees a soup's tree right away: it is full of reference cycles (parent, next_element, ...) and would otherwise stay
+#allocated until the next garbage collection. decompose() on the soup itself does not reach its children.
+def release_soup(soup):
+    for element in list(soup.contents):
+        if isinstance(element, Tag):
+            element.decompose()
+        else:
+            element.extract()
+    soup.decompose()
+
+#Downloads url and runs extractor(soup, *args) on it. The page's ETag/Last-Modified are kept with the extracted result,
+#so a later fetch of the same page is conditional and a 304 Not Modified answer returns that result without a download or parse.
+def fetch_and_extract(url, extractor, *args):
+    result_key = json.dumps([extractor.__name__, args])
+    validated = scrape_cache.get_validated(url)
+
+    headers = {}
+    if validated is not None and result_key in validated["results"]:
+        if validated["etag"]:
+            headers['If-None-Match'] = validated["etag"]
+        if validated["last_modified"]:
+            headers['If-Modified-Since'] = validated["last_modified"]
+
+    response = get_with_backoff(url, stop_plan=getattr(extractor, 'stop_plan', None) if STREAM_FETCH else None, headers=headers)
+    if response.status_code == 304 and headers:
+        scrape_cache.count('revalidated')
+        return validated["results"][result_key]
 
-#Wrapper function for requests.get with exponential back-off on 429 responses (dealing wiithb rate-limit of GitHub)
-@backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=3)
-def get_with_backoff(url, **kwargs):
-    response = requests.get(url, **kwargs)
-    response.raise_for_status()
-    return response
+    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
+        result = extract_page(response.content, extractor, *args)
+        scrape_cache.set_validated(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), result_key, result)
+        return result
+    else:
+        return None
 
-def check_user_type(url):
+#Function resolving an account from its profile page, shared by GET /users/{username} and GET /users/{username}/repos.
+#The page is downloaded and parsed once for the account's type (1 for a person, 0 for an organisation),
+#its user data and the owner fields of its repos.
+@scrape_cache.cached('profile', serve_stale=True)
+def scrape_profile(url, username):
     try:
-        response = get_with_backoff(url)
-        response.raise_for_status()
+        profile = fetch_and_extract(url, extract_profile, url, username)
+        scrape_store.put_user(username, profile)
+        return profile
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 404:
             return None
-        if e.response.status_code == 304:
-            return None
         raise
 
-    #response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        #Extract user's type (user or organisation)
-        user_type_element = soup.find('div', class_='h-card mt-md-n5')
-        if user_type_element is not None:
-            user_type = 1
-        else:
-            user_type = 0
+def extract_profile(soup, url, username):
+    user_type = extract_user_type(soup)
+    if user_type == 1:
+        user_data = scrape_person_user(soup,url,username)
+    else:
+        user_data = scrape_org_user(soup,url,username)
+
+    owner = {"login": username, "id": user_data["id"], "avatar_url": user_data["avatar_url"]}
+    return {"type": user_type, "user": user_data, "owner": owner}
+
+#Tags read by scrape_person_user and scrape_org_user (a superset: anything a find() there can match must be kept).
+#The parser passes the raw attributes, so class is still a single string here.
+PROFILE_ITEMPROPS = ('image', 'url', 'homeLocation', 'location', 'additionalName', 'name')
+
+def is_profile_tag(name, attrs):
+    classes = (attrs.get('class') or '').split()
+    href = attrs.get('href') or ''
+    if name == 'meta':
+        return attrs.get('property') in ('profile:username', 'og:url')
+    if attrs.get('itemprop') in PROFILE_ITEMPROPS:
+        return True
+    if name == 'div':
+        return 'h-card' in classes or 'user-profile-bio' in classes or 'color-fg-muted' in classes
+    if name == 'span':
+        return 'p-org' in classes
+    if name == 'h1':
+        return 'h2' in classes
+    if name == 'a':
+        return 'twitter.com' in href or 'repositories' in href or 'followers' in href or 'following' in href
+    return False
+
+extract_profile.parse_only = SoupStrainer(is_profile_tag)
+
+#Account behind GET /users/{username}/repos: its type and the owner of its repos, which do not change. With the
+#incremental crawl they are read from the stored profile (scrape_store.py) while it is recent enough, without a download.
+def scrape_account(url, username):
+    profile = scrape_store.stored_user(username)
+    return profile if profile is not None else scrape_profile(url, username)
 
-        return user_type
+def check_user_type(url):
+    username = urlsplit(url).path.strip('/')
+    profile = scrape_profile(url, username)
+    return profile["type"] if profile is not None else None
+
+def extract_user_type(soup):
+    #Extract user's type (user or organisation)
+    user_type_element = soup.find('div', class_='h-card mt-md-n5')
+    if user_type_element is not None:
+        user_type = 1
     else:
-        return None
+        user_type = 0
+
+    return user_type
 
 #Function for GET /users/{username}
 def scrape_github_users_endpoint(url,username):
+    profile = scrape_profile(url, username)
+    return profile["user"] if profile is not None else None
+
+#GitHub logins, a batch does not look anything else up
+LOGIN_PATTERN = re.compile(r'[A-Za-z0-9](?:[A-Za-z0-9-]{0,38})')
+
+#Function for POST /users:batch, scrapes the profiles of many users on the shared worker pool, at most ENRICH_WORKERS
+#at a time, and yields (username, profile) in the order of usernames. A failing user does not stop the others, its
+#profile is the exception instead (a missing user, or one that is no valid login, is None as for scrape_profile).
+def stream_profiles(usernames):
+    executor = get_enrich_executor()
+    futures = deque()
+    for username in usernames:
+        if not LOGIN_PATTERN.fullmatch(username):
+            futures.append((username, None))
+            continue
+        futures.append((username, executor.submit(contextvars.copy_context().run, scrape_profile, f'{GITHUB_URL}/{username}', username)))
+        if len(futures) >= ENRICH_WORKERS:
+            yield profile_result(*futures.popleft())
+    while futures:
+        yield profile_result(*futures.popleft())
+
+def scrape_profiles(usernames):
+    return list(stream_profiles(usernames))
+
+def profile_result(username, future):
+    if future is None:
+        return username, None
     try:
-        response = get_with_backoff(url)
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            return None
-        if e.response.status_code == 304:
-            return None
-        raise
-    
-    #response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-
-        #Extract user's type (user or organisation)
-        user_type_element = soup.find('div', class_='h-card mt-md-n5')
-        if user_type_element is not None:
-            user_data = scrape_person_user(soup,url,username)
-        else:
-            user_data = scrape_org_user(soup,url,username)
+        return username, future.result()
+    except Exception as e:
+        return username, e
+
+#Extraction plans of the person and organisation profile pages (see extraction_plan.py): every row is the soup.find()
+#that used to read the field, all of them are evaluated in one walk over the page
+PERSON_PROFILE_PLAN = ExtractionPlan([
+    ('login', Selector('span', class_='p-nickname vcard-username d-block', itemprop='additionalName'), text),
+    ('avatar_url', Selector('a', itemprop='image'), attribute('href')),
+    ('name', Selector('span', class_='p-name vcard-fullname d-block overflow-hidden', itemprop='name'), text),
+    ('company', Selector('span', class_='p-org'), text),
+    ('blog', Selector('li', itemprop='url'), child_text('a')),
+    ('location', Selector('li', itemprop='homeLocation'), child_text('span')),
+    ('bio', Selector('div', class_='p-note user-profile-bio mb-3 js-user-profile-bio f4'), child_text('div')),
+    ('twitter_username', Selector('a', href=contains('twitter.com')), text),
+    ('public_repos', Selector('a', href='/{username}?tab=repositories'), child_text('span')),
+    ('followers', Selector('a', href='https://github.com/{username}?tab=followers'), child_text('span')),
+    ('following', Selector('a', href='https://github.com/{username}?tab=following'), child_text('span')),
+])
+
+ORG_PROFILE_PLAN = ExtractionPlan([
+    ('login', Selector('meta', property='profile:username'), attribute('content')),
+    ('avatar_url', Selector('img', itemprop='image'), attribute('src')),
+    ('html_url', Selector('meta', property='og:url'), attribute('content')),
+    ('name', Selector('h1', class_='h2 lh-condensed'), text),
+    ('blog', Selector('a', itemprop='url'), attribute('href')),
+    ('location', Selector('span', itemprop='location'), text),
+    ('bio', Selector('div', class_='color-fg-muted'), child_text('div')),
+    ('twitter_username', Selector('a', href=contains('twitter.com')), text),
+    ('public_repos', Selector('a', href=contains('repositories')), child_text('span', class_='Counter js-profile-repository-count')),
+    ('followers', Selector('a', href=contains('followers')), child_text('span')),
+])
 
-        return user_data
-    else:
-        return None
-    
 def scrape_person_user(soup,url, username):
-    #Extract the user's login
-    login_element = soup.find('span',class_='p-nickname vcard-username d-block', itemprop= 'additionalName')
-    user_login = login_element.text.strip() if login_element else None
-
-    #Extract user's id
-    data_element = soup.find('a', itemprop= 'image')
-    data = data_element["href"] if data_element else None
-
-    # Extracting the specific substring from the user's blog URL
-    if data is not None:
-        # Extracting the numeric value after the last '/'
-        data_parts = data.split('/')
-        last_part = data_parts[-1]
-        
-        # If the last part has a query parameter (?v=4), remove it
-        last_part = last_part.split('?')[0]
-        
-        # Try to convert the last part to an integer
-        try:
-            extracted_number = int(last_part)
-            user_id = extracted_number
-        except ValueError:
-            user_id = None
+    fields = PERSON_PROFILE_PLAN.evaluate(soup, username=username)
 
-    #Extract user's avatar_url
-    avatar_element = soup.find('a', itemprop= 'image')
-    user_avatar_url = avatar_element["href"] if avatar_element else None
-
-    #Extract user's url
-    user_url = f"https://api.github.com/users/{username}"
-
-    #Extract user's html_url
-    user_html_url = url
-
-    #Extract user's type
-    user_type = "User"
-
-    #Extract user's name
-    full_name_element = soup.find('span', class_= 'p-name vcard-fullname d-block overflow-hidden', itemprop = 'name')
-    user_name = full_name_element.text.strip() if full_name_element else None
-        
-    #Extract user's company
-    company_element = soup.find('span', class_='p-org')
-    user_company = company_element.text.strip() if company_element else None
-
-    #Extract user's blog
-    blog_element = soup.find('li', itemprop= 'url')
-    user_blog = blog_element.find('a') if blog_element else None
-    user_blog = user_blog.text.strip() if user_blog else None
-
-    #Extract user's location
-    location_element = soup.find('li', itemprop = 'homeLocation')
-    user_location = location_element.find('span') if location_element else None
-    user_location = user_location.text.strip() if user_location else None
-
-    #Extract user's bio
-    bio_element = soup.find('div', class_ = 'p-note user-profile-bio mb-3 js-user-profile-bio f4')
-    user_bio = bio_element.find('div') if bio_element else None
-    user_bio = user_bio.text.strip() if user_bio else None
-
-    #Extract user's twitter_username
-    twitter_handle_element = soup.find('a', href=lambda href: href and 'twitter.com' in href)
-    user_twitter = twitter_handle_element.text.strip() if twitter_handle_element else None
-
-    #Extract user's public_repos
-    number_public_repo_element = soup.find('a', href = f'/{username}?tab=repositories')
-    user_repos = number_public_repo_element.find('span') if number_public_repo_element else None
-    user_repos = user_repos.text.strip() if user_repos else None
-    if user_repos is not None:
-        user_repos = convert_k_to_zeros(user_repos)
-
-    #Extract user's followers
-    number_followers_element = soup.find('a', href= f'https://github.com/{username}?tab=followers')
-    user_followers = number_followers_element.find('span') if number_followers_element else None
-    user_followers = user_followers.text.strip() if user_followers else None
-    if user_followers is not None:
-        user_followers = convert_k_to_zeros(user_followers)
-
-    #Extract user's follwing
-    number_following_element = soup.find('a', href= f'https://github.com/{username}?tab=following')
-    user_following = number_following_element.find('span') if number_following_element else None
-    user_following = user_following.text.strip() if user_following else None
-    if user_following is not None:
-            user_following = convert_k_to_zeros(user_following)
-
-    user_data = {"login": user_login, "id": user_id, "avatar_url": user_avatar_url, "url": user_url, "html_url": user_html_url, "type": user_type, "name": user_name, "company": user_company, "blog": user_blog, "location": user_location, "bio": user_bio, "twitter_username": user_twitter, "public_repos": user_repos, "followers": user_followers, "following": user_following}
+    #The id is the number at the end of the avatar url
+    user_id = avatar_url_to_id(fields["avatar_url"])
+
+    #Counts are shown abbreviated (e.g. 1.2k)
+    user_repos = convert_k_to_zeros(fields["public_repos"]) if fields["public_repos"] is not None else None
+    user_followers = convert_k_to_zeros(fields["followers"]) if fields["followers"] is not None else None
+    user_following = convert_k_to_zeros(fields["following"]) if fields["following"] is not None else None
+
+    user_data = {"login": fields["login"], "id": user_id, "avatar_url": fields["avatar_url"], "url": f"https://api.github.com/users/{username}", "html_url": url, "type": "User", "name": fields["name"], "company": fields["company"], "blog": fields["blog"], "location": fields["location"], "bio": fields["bio"], "twitter_username": fields["twitter_username"], "public_repos": user_repos, "followers": user_followers, "following": user_following}
     
     return user_data
 
 
 def scrape_org_user(soup, url, username):
-    #Extract the user's login
-    login_element = soup.find('meta', {'property': 'profile:username'})
-    user_login = login_element["content"] if login_element else None
+    fields = ORG_PROFILE_PLAN.evaluate(soup)
 
-    #Extract user's id
-    data_element = soup.find('img', itemprop= 'image')
-    data = data_element["src"] if data_element else None
-    
-    if data is not None:
-        # Extracting the numeric value after the last '/'
-        data_parts = data.split('/')
-        last_part = data_parts[-1]
-
-        # If the last part has a query parameter (?v=4), remove it
-        last_part = last_part.split('?')[0]
-        
-        # Try to convert the last part to an integer
-        try:
-            extracted_number = int(last_part)
-            user_id = extracted_number
-        except ValueError:
-            user_id = None
+    #The id is the number at the end of the avatar url
+    user_id = avatar_url_to_id(fields["avatar_url"])
 
-    #Extract user's avatar_url
-    avatar_element = soup.find('img', itemprop= 'image')
-    user_avatar_url = avatar_element["src"] if avatar_element else None
+    #The repository count is kept as shown, an organisation follows nobody
+    user_followers = convert_k_to_zeros(fields["followers"]) if fields["followers"] is not None else None
 
-    #Extract user's url
-    user_url = f"https://api.github.com/users/{username}"
+    user_data = {"login": fields["login"], "id": user_id, "avatar_url": fields["avatar_url"], "url": f"https://api.github.com/users/{username}", "html_url": fields["html_url"], "type": "Organization", "name": fields["name"], "company": None, "blog": fields["blog"], "location": fields["location"], "bio": fields["bio"], "twitter_username": fields["twitter_username"], "public_repos": fields["public_repos"], "followers": user_followers, "following": 0}
 
-    #Extract user's html_url
-    url_element = soup.find('meta', {'property': 'og:url'})
-    user_html_url = url_element["content"] if url_element else None
+    return user_data
 
-    #Extract user's type
-    user_type = "Organization"
-    
-    #Extract user's name
-    full_name_element = soup.find('h1', class_= 'h2 lh-condensed')
-    user_name = full_name_element.text.strip() if full_name_element else None
+#Function for GET /users/{username}/repos for user
+LISTING_PAGE_SIZE = 30     #Repos on one page of GitHub's own repository listings
+#Attributes of the li of one repo row. A person's rows are matched by their itemprop, their class list changes with the
+#kind of repo (public source, public fork, public archive...) and every row counts towards the 30 of a listing page.
+USER_REPO_ROW = {'itemprop': 'owns'}
+ORG_REPO_ROW = {'class_': 'Box-row'}
+
+#Adds GitHub's own page (and sort) query parameters to a listing url
+def listing_page_url(url, upstream_page, upstream_sort):
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query)
+    query.append(('page', str(upstream_page)))
+    if upstream_sort is not None:
+        query.append(('sort', upstream_sort))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+#Reads the total number of repos from the counter of the listing's Repositories tab (its title holds the exact number)
+def extract_listing_total(soup):
+    for link in soup.find_all('a', href=lambda href: href and 'repositories' in href):
+        counter = link.find('span', class_='Counter')
+        if counter is not None:
+            total = (counter.get('title') or counter.text).strip().replace(',', '')
+            return int(total) if total.isdigit() else None
+    return None
+
+#What is read from one listing page, extracted as soon as it is parsed so its soup is released before the repo pages are
+#scraped: the rows, the total repo count and the href of the owner's avatar (a person's repositories tab shows it)
+ListingPage = namedtuple('ListingPage', ('rows', 'total', 'avatar_url'))
+#One repo row of a listing. label is the text of its visibility label (e.g. 'Public', 'Public archive'), topics a tuple.
+ListingRow = namedtuple('ListingRow', ('name', 'href', 'label', 'description', 'language', 'topics', 'pushed_at'))
+
+def extract_listing_page(soup, row_attrs):
+    rows = [extract_listing_row(repo_element) for repo_element in soup.find_all('li', **row_attrs)]
+    avatar_element = soup.find('a', itemprop= 'image')
+    return ListingPage(rows, extract_listing_total(soup), avatar_element["href"] if avatar_element else None)
+
+def extract_listing_row(repo_element):
+    name_element = repo_element.find('a', itemprop= 'name codeRepository')
+    label_element = repo_element.find('span', class_='Label Label--secondary v-align-middle ml-1 mb-1')
+    description_element = repo_element.find('p', itemprop='description')
+    language_element = repo_element.find('span', itemprop='programmingLanguage')
+    topic_elements = repo_element.find_all('a', class_='topic-tag topic-tag-link f6 my-1')
+    pushed_element = repo_element.find('relative-time')
+    return ListingRow(
+        name=name_element.text.strip() if name_element else None,
+        href=name_element["href"] if name_element else None,
+        label=label_element.text.strip() if label_element else None,
+        description=description_element.text.strip() if description_element else None,
+        language=language_element.text.strip() if language_element else None,
+        topics=tuple(topic_elem.text.strip() for topic_elem in topic_elements),
+        pushed_at=pushed_element["datetime"] if pushed_element else None,
+    )
+
+#Crawls GitHub's paginated repository listing at url and returns the rows (ListingRow) of the requested API page, together
+#with the first listing page downloaded (None when GitHub did not answer with a 200).
+#GitHub sorts by name ascending (sort=name) and by last update descending (its default), so for those orders only the
+#listing pages covering the requested slice are downloaded. The two other orders are the same lists read from the end,
+#located with the total repo count; the whole listing is only crawled when that count can not be read.
+def scrape_listing(url, row_attrs, per_page, sort_by, direction, page):
+    crawl = crawl_listing(url, per_page, sort_by, direction, page)
+    try:
+        upstream_page, upstream_url = next(crawl)
+        while True:
+            upstream_page, upstream_url = crawl.send(fetch_listing_page(upstream_page, upstream_url, row_attrs))
+    except StopIteration as stop:
+        return stop.value
 
-    #Extract user's company
-    user_company = None
+def fetch_listing_page(upstream_page, upstream_url, row_attrs):
+    try:
+        response = get_with_backoff(upstream_url)
+    except requests.exceptions.HTTPError as e:
+        #A page past the end of the listing is simply empty
+        if upstream_page == 1 or e.response.status_code != 404:
+            raise
+        return None
+    return extract_page(response.content, extract_listing_page, row_attrs) if response.status_code == 200 else None
+
+#The crawl itself does no I/O, so the synchronous and the asyncio scrapers share it: it yields the
+#(page number, url) of each listing page it needs and is sent back that ListingPage (None if it is not a 200).
+def crawl_listing(url, per_page, sort_by, direction, page):
+    upstream_sort = 'name' if sort_by == 'full_name' else None
+    if sort_by == 'full_name':
+        from_end = direction == 'desc'
+    else:
+        from_end = direction == 'asc'
+
+    start_index = (page - 1) * per_page
+    end_index = start_index + per_page
+
+    #Only the first page is asked for more than once (for the total and the owner), the others are not kept
+    first_listings = {}
+    def listing_page(upstream_page):
+        if upstream_page in first_listings:
+            return first_listings[upstream_page]
+        listing = yield upstream_page, listing_page_url(url, upstream_page, upstream_sort)
+        if upstream_page == 1:
+            first_listings[upstream_page] = listing
+        return listing
+
+    if from_end:
+        listing = yield from listing_page(1)
+        total = listing.total if listing is not None else None
+        if total is None:
+            #Only the end_index last rows of the listing can be on the requested page, the earlier ones are dropped as it is read
+            repos_list = deque(maxlen=end_index)
+            upstream_page = 1
+            while listing is not None:
+                repos_list.extend(listing.rows)
+                if len(listing.rows) < LISTING_PAGE_SIZE:
+                    break
+                upstream_page += 1
+                listing = yield from listing_page(upstream_page)
+            repos_list.reverse()
+            return list(repos_list)[start_index:end_index], (yield from listing_page(1))
+        start_index, end_index = max(total - end_index, 0), max(total - start_index, 0)
+
+    if end_index <= start_index:
+        return [], (yield from listing_page(1))
+
+    first_page = start_index // LISTING_PAGE_SIZE + 1
+    last_page = (end_index - 1) // LISTING_PAGE_SIZE + 1
+    repos_list = []
+    first_listing = None
+    for upstream_page in range(first_page, last_page + 1):
+        listing = yield from listing_page(upstream_page)
+        if listing is None:
+            break
+        if first_listing is None:
+            first_listing = listing
+        repos_list.extend(listing.rows)
+        if len(listing.rows) < LISTING_PAGE_SIZE:
+            break
+
+    if first_listing is None and first_page > 1:
+        return [], (yield from listing_page(1))
+
+    offset = (first_page - 1) * LISTING_PAGE_SIZE
+    repos_list = repos_list[start_index - offset:end_index - offset]
+    if from_end:
+        repos_list.reverse()
+    return repos_list, first_listing
+
+#Output fields of a repo read from the listing page, and those that need the repo's own page (the 2nd layer)
+REPO_LISTING_OUTPUT_FIELDS = ('name', 'full_name', 'owner', 'html_url', 'private', 'description', 'url', 'language', 'topics', 'archived', 'pushed_at')
+REPO_PAGE_OUTPUT_FIELDS = ('id', 'fork', 'homepage', 'forks_count', 'stargazers_count', 'watchers_count', 'default_branch', 'open_issues_count', 'has_issues', 'has_projects', 'has_discussions')
+
+#Scrapes the 2nd layer of the repos at layered_urls, unless fields (the output fields asked for, None for all) needs none of it.
+#pushed_dates (the pushed_at of every listing row) lets the incremental crawl skip the repos not pushed to since they were stored.
+def scrape_repo_pages_for_fields(layered_urls, fields, pushed_dates=None):
+    return list(iter_repo_pages_for_fields(layered_urls, fields, pushed_dates))
+
+def iter_repo_pages_for_fields(layered_urls, fields, pushed_dates=None):
+    if fields is not None and not set(fields).intersection(REPO_PAGE_OUTPUT_FIELDS):
+        return (dict.fromkeys(REPO_PAGE_FIELDS) for _ in layered_urls)
+    return iter_repo_pages(layered_urls, pushed_dates)
+
+def select_fields(repo, fields):
+    if fields is None:
+        return repo
+    return {key: value for key, value in repo.items() if key in fields}
+
+#Fields of a repo page that could not be scraped (it failed, or was still pending at the deadline)
+def unavailable_repo_page():
+    repo_page = dict.fromkeys(REPO_PAGE_FIELDS)
+    repo_page['unavailable'] = True
+    return repo_page
+
+#A repo built from an unavailable repo page lists the (selected) output fields it is missing, which makes the response partial
+def mark_unavailable(repo, repo_page):
+    if repo_page.get('unavailable'):
+        repo['unavailable_fields'] = [field for field in REPO_PAGE_OUTPUT_FIELDS if field in repo]
+    return repo
+
+#Partial listings are not cached, the missing fields are scraped again by the next call
+def is_complete(repos):
+    return repos is None or not any('unavailable_fields' in repo for repo in repos)
+
+#owner is the "owner" of scrape_profile, when it is not given it is read from the listing page itself.
+#fields limits every repo to those output fields, None returns them all.
+@scrape_cache.cached('user_repos', serve_stale=True, cacheable=is_complete)
+def scrape_user_repo(url,username,per_page,sort_by,direction,page,owner=None,fields=None):
+    repos = iter_user_repo(url, username, per_page, sort_by, direction, page, owner, fields)
+    return list(repos) if repos is not None else None
+
+#Streaming variant of scrape_user_repo (see scrape_cache.cached), returns None or an iterator of the repos
+def stream_user_repo(url,username,per_page,sort_by,direction,page,owner=None,fields=None):
+    return scrape_user_repo.stream(iter_user_repo, url, username, per_page, sort_by, direction, page, owner, fields)
+
+#Scrapes the listing page right away and returns None or a generator of its repos, each one yielded as soon as
+#its repo page is scraped. The repo pages are all requested at once and yielded in the order of the listing.
+def iter_user_repo(url,username,per_page,sort_by,direction,page,owner=None,fields=None):
+    page_repos_list, listing = scrape_listing(url, USER_REPO_ROW, per_page, sort_by, direction, page)
+    if listing is None:     #GitHub API documentation specified 200 as a successful response
+        return None
+    if owner is None:
+        owner = listing_owner(listing, username)
 
-    #Extract user's blog
-    blog_element = soup.find('a', itemprop= 'url')
-    user_blog = blog_element["href"] if blog_element else None
+    # Scrape the 2nd layer of every repo on this page concurrently, results keep the page order
+    repo_pages = iter_repo_pages_for_fields(listing_layered_urls(page_repos_list), fields, listing_pushed_dates(page_repos_list))
+    return (mark_unavailable(select_fields(build_user_repo(row, repo_page, owner), fields), repo_page) for row, repo_page in zip(page_repos_list, repo_pages))
 
-    #Extract user's location
-    location_element = soup.find('span', itemprop = 'location')
-    user_location = location_element.text.strip() if location_element else None
+#Builds the repo dict of one row (ListingRow) of a person's listing from the row and the fields of the repo's own page
+@metrics.timed('build_user_repo')
+def build_user_repo(row, repo_page, owner):
+    repo = {}
 
-    #Extract user's bio
-    bio_element = soup.find('div', class_ = 'color-fg-muted')
-    user_bio = bio_element.find('div') if bio_element else None
-    user_bio = user_bio.text.strip() if user_bio else None
+    #Extract repos' name and full name
+    repo['name'] = row.name
+    repo['full_name'] = row.href
 
-    #Extract user's twitter_username
-    twitter_handle_element = soup.find('a', href=lambda href: href and 'twitter.com' in href)
-    user_twitter = twitter_handle_element.text.strip() if twitter_handle_element else None
+    #Extract repos' owner (i.e. owner id and owner login)
+    repo['owner'] = {"login": owner["login"], "id": owner["id"]}
 
-    #Extract user's public_repos
-    number_public_repo_element = soup.find('a',href=lambda href: href and 'repositories' in href)
-    number_public_repo_element = number_public_repo_element.find('span',class_='Counter js-profile-repository-count') if number_public_repo_element else None
-    user_repos = number_public_repo_element.text.strip() if number_public_repo_element else None
-    # if user_repos is not None:
-    #     user_repos = convert_k_to_zeros(user_repos)
+    #Extract repos' html url
+    repo['html_url'] = f'https://github.com{row.href}'
 
-    #Extract user's followers
-    number_followers_element = soup.find('a', href=lambda href: href and 'followers' in href)
-    user_followers = number_followers_element.find('span') if number_followers_element else None
-    user_followers = user_followers.text.strip() if user_followers else None
-    if user_followers is not None:
-        user_followers = convert_k_to_zeros(user_followers)
 
-    #Extract user's follwing
-    user_following = 0
+    #Extract repos' id
+    id = repo_page['id']
+    repo['id'] = int(id) if id is not None else None
 
-    user_data = {"login": user_login, "id": user_id, "avatar_url": user_avatar_url, "url": user_url, "html_url": user_html_url, "type": user_type, "name": user_name, "company": user_company, "blog": user_blog, "location": user_location, "bio": user_bio, "twitter_username": user_twitter, "public_repos": user_repos, "followers": user_followers, "following": user_following}
+    #Extract repos' private
+    if row.label == 'Public':
+        repo['private'] = bool(1)
+    else:
+        repo['private'] = bool(0)
 
-    return user_data
+    #Extract repos' description
+    repo['description'] = row.description
 
-#Function for GET /users/{username}/repos for user
-def scrape_user_repo(url,username,per_page,sort_by,direction,page):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        user_repo_list = []
-        repos_list = soup.find_all('li', class_='col-12 d-flex flex-justify-between width-full py-4 border-bottom color-border-muted public source' )
-
-        if sort_by == 'full_name':
-            key_function = lambda x: x.find('a').text.strip().lower()
-        elif sort_by == 'pushed':
-            key_function = lambda x: x.find('relative-time')['datetime']
-
-        sorted_repos_list = sorted(repos_list, key=key_function, reverse=(direction == 'desc'))
-
-        start_index = (page - 1) * per_page
-        end_index = start_index + per_page
-
-        for repo_element in sorted_repos_list[start_index:end_index]:
-            repo = {}
-
-            #Extract repos' name and full name
-            name_element = repo_element.find('a', itemprop= 'name codeRepository')
-            repo['name'] = name_element.text.strip() if name_element else None
-            repo['full_name'] = name_element["href"] if name_element else None
-
-            #Extract repos' owner (i.e. owner id and owner login)
-            owner_login = username
-            data_element = soup.find('a', itemprop= 'image')
-            data = data_element["href"] if data_element else None
-            # Extracting the specific substring from the user's blog URL
-            if data is not None:
-            # Extracting the numeric value after the last '/'
-                data_parts = data.split('/')
-                last_part = data_parts[-1]
-            
-            # If the last part has a query parameter (?v=4), remove it
-                last_part = last_part.split('?')[0]
-            
-            # Try to convert the last part to an integer
-                try:
-                    extracted_number = int(last_part)
-                    owner_id = extracted_number
-                except ValueError:
-                    owner_id = None
-            repo['owner'] ={"login": owner_login, "id": owner_id}
-
-            #Extract repos' html url
-            html_element = repo_element.find('a', itemprop= 'name codeRepository')
-            html_url = html_element["href"] if html_element else None
-            repo['html_url'] = f'https://github.com{html_url}'
-
-            # Creating 2nd layer of scraper url to scrape data from each repo's endpoint
-            layered_url = f'https://github.com{html_url}'
-
-            #Extract repos' id
-            id = scrape_repo_id(layered_url)
-            repo['id'] = int(id)
-
-            #Extract repos' private
-            private_element = repo_element.find('span', class_='Label Label--secondary v-align-middle ml-1 mb-1')
-            checker = private_element.text.strip() if private_element else None
-            if checker == 'Public':
-                repo['private'] = bool(1)
-            else:
-                repo['private'] = bool(0)
-
-            #Extract repos' description
-            description_element = repo_element.find('p', itemprop='description')
-            repo['description'] = description_element.text.strip() if description_element else None
-
-            #Extract repos' fork
-            fork = scrape_repo_fork(layered_url)
-            if fork is not None:
-                repo['fork'] = bool(fork)
-            else:
-                repo['fork'] = None
-
-            #Extract repos' url
-            url_element = repo_element.find('a', itemprop= 'name codeRepository')
-            url = html_element['href'] if html_element else None
-            repo['url'] = f'https://api.github.com/repos{url}'
-
-            #Extract repos' homepage
-            homepage = scrape_repo_homepage(layered_url)
-            repo['homepage'] = homepage
-
-            #Extract repos' language
-            language_element = repo_element.find('span', itemprop='programmingLanguage')
-            repo['language'] = language_element.text.strip() if language_element else None
-
-            #Extract repos' forks count
-            forks_num = scrape_repo_forks_count(layered_url)
-            if forks_num is not None:
-                repo['forks_count'] = convert_k_to_zeros(forks_num)
-            else:
-                repo['forks_count'] = None
-
-            #Extract repos' stargazers count
-            stargazers_num = scrape_repo_stargazers_count(layered_url)
-            if stargazers_num is not None:
-                repo['stargazers_count'] = convert_k_to_zeros(stargazers_num)
-            else:
-                repo['stargazers_count'] = None
-
-            #Extract repos' watchers count
-            if stargazers_num is not None:
-                repo['watchers_count'] = convert_k_to_zeros(stargazers_num)
-            else:
-                repo['watchers_count'] = None
-
-            #Extract repos' default branch
-            default_branch = scrape_repo_default_branch(layered_url)
-            repo['default_branch'] = default_branch
-
-            #Extract repos' open issues count and has_issues field
-            open_issues_num = scrape_repo_open_issues_count(layered_url)
-            if open_issues_num is not None:
-                open_issues_num = convert_k_to_zeros(open_issues_num)
-                repo['open_issues_count'] = open_issues_num
-                #repo['open issues count'] = open_issues_num
-                if open_issues_num > 0:
-                    repo['has_issues'] = bool(1)
-                else:
-                    repo['has_issues'] = bool(0)
-            else:
-                repo['open issues count'] = None
-                repo['has_issues'] = None
-
-            #Extract repos' topics
-            topics = []
-            topic_elements = repo_element.find_all('a', class_='topic-tag topic-tag-link f6 my-1')
-            for topic_elem in topic_elements:
-                topics.append(topic_elem.text.strip())
-            repo['topics'] = topics
-
-            #Extract repos' has projects
-            projects_num = scrape_repo_has_projects(layered_url)
-            if projects_num is not None:
-                projects_num = convert_k_to_zeros(projects_num)
-                if projects_num > 0:
-                    repo['has_projects'] = bool(1)
-                else:
-                    repo['has_projects'] = bool(0)
-            else:
-                repo['has_projects'] = None
-
-            #Extract repos' has discussions
-            discussions = scrape_repo_discussions(layered_url)
-            if discussions is not None:
-                repo['has_discussions'] = bool(1)
-            else:
-                repo['has_discussions'] = bool(0)    
-
-            #Extract repos' archived
-            archive_element = repo_element.find('span', class_='Label Label--secondary v-align-middle ml-1 mb-1')
-            archive_element = private_element.text.strip() if archive_element else None
-            checker = "archive"
-            if archive_element is not None:
-                if checker in archive_element:
-                    repo['archived'] = bool(1)
-                else:
-                    repo['archived'] = bool(0)
-            
-            #Extract repos' pushed at date
-            pushed_element = repo_element.find('relative-time')
-            repo['pushed_at'] = pushed_element["datetime"] if pushed_element else None
-    
-            user_repo_list.append(repo)
-        return user_repo_list
+    #Extract repos' fork
+    fork = repo_page['fork']
+    if fork is not None:
+        repo['fork'] = bool(fork)
     else:
-        return None
+        repo['fork'] = None
+
+    #Extract repos' url
+    repo['url'] = f'https://api.github.com/repos{row.href}'
+
+    #Extract repos' homepage
+    homepage = repo_page['homepage']
+    repo['homepage'] = homepage
+
+    #Extract repos' language
+    repo['language'] = row.language
+
+    #Extract repos' forks count
+    forks_num = repo_page['forks_count']
+    if forks_num is not None:
+        repo['forks_count'] = convert_k_to_zeros(forks_num)
+    else:
+        repo['forks_count'] = None
+
+    #Extract repos' stargazers count
+    stargazers_num = repo_page['stargazers_count']
+    if stargazers_num is not None:
+        repo['stargazers_count'] = convert_k_to_zeros(stargazers_num)
+    else:
+        repo['stargazers_count'] = None
+
+    #Extract repos' watchers count
+    if stargazers_num is not None:
+        repo['watchers_count'] = convert_k_to_zeros(stargazers_num)
+    else:
+        repo['watchers_count'] = None
+
+    #Extract repos' default branch
+    default_branch = repo_page['default_branch']
+    repo['default_branch'] = default_branch
+
+    #Extract repos' open issues count and has_issues field
+    open_issues_num = repo_page['open_issues_count']
+    if open_issues_num is not None:
+        open_issues_num = convert_k_to_zeros(open_issues_num)
+        repo['open_issues_count'] = open_issues_num
+        #repo['open issues count'] = open_issues_num
+        if open_issues_num > 0:
+            repo['has_issues'] = bool(1)
+        else:
+            repo['has_issues'] = bool(0)
+    else:
+        repo['open issues count'] = None
+        repo['has_issues'] = None
+
+    #Extract repos' topics
+    repo['topics'] = list(row.topics)
+
+    #Extract repos' has projects
+    projects_num = repo_page['has_projects']
+    if projects_num is not None:
+        projects_num = convert_k_to_zeros(projects_num)
+        if projects_num > 0:
+            repo['has_projects'] = bool(1)
+        else:
+            repo['has_projects'] = bool(0)
+    else:
+        repo['has_projects'] = None
+
+    #Extract repos' has discussions
+    discussions = repo_page['discussions']
+    if discussions is not None:
+        repo['has_discussions'] = bool(1)
+    else:
+        repo['has_discussions'] = bool(0)    
+
+    #Extract repos' archived
+    checker = "archive"
+    if row.label is not None:
+        if checker in row.label:
+            repo['archived'] = bool(1)
+        else:
+            repo['archived'] = bool(0)
+
+    #Extract repos' pushed at date
+    repo['pushed_at'] = row.pushed_at
+
+    return repo
     
+#Urls of the repos' own pages (the 2nd layer) of some listing rows
+def listing_layered_urls(repos_list):
+    return [f'{GITHUB_URL}{row.href}' for row in repos_list]
+
+def listing_pushed_dates(repos_list):
+    return [row.pushed_at for row in repos_list]
+
+#Fallback for the owner of a person's repos, read from the avatar on the repositories tab
+def listing_owner(listing, username):
+    return {"login": username, "id": avatar_url_to_id(listing.avatar_url), "avatar_url": listing.avatar_url}
+
 #Function for GET /users/{username}/repos for organisations
-def scrape_org_repo(url,username,per_page,sort_by,direction,page):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        org_repo_list = []
-        repos_list = soup.find_all('li', class_='Box-row' )
-
-        if sort_by == 'full_name':
-            key_function = lambda x: x.find('a').text.strip().lower()
-        elif sort_by == 'pushed':
-            key_function = lambda x: x.find('relative-time')['datetime']
-
-        sorted_repos_list = sorted(repos_list, key=key_function, reverse=(direction == 'desc'))
-
-        start_index = (page - 1) * per_page
-        end_index = start_index + per_page
-
-        for repo_element in sorted_repos_list[start_index:end_index]:
-            repo = {}
-
-            #Extract repos' name and full name
-            name_element = repo_element.find('a', itemprop= 'name codeRepository')
-            repo['name'] = name_element.text.strip() if name_element else None
-            repo['full_name'] = name_element["href"] if name_element else None
-
-            #Extract repos' owner (i.e. owner id and owner login)
-            login_element = soup.find('a', class_='color-fg-default no-underline')
-            user_login = login_element["data-name"] if login_element else None
-
-            data_element = soup.find('img', itemprop= 'image')
-            data = data_element["src"] if data_element else None
-            
-            if data is not None:
-                # Extracting the numeric value after the last '/'
-                data_parts = data.split('/')
-                last_part = data_parts[-1]
-
-                # If the last part has a query parameter (?v=4), remove it
-                last_part = last_part.split('?')[0]
-                
-                # Try to convert the last part to an integer
-                try:
-                    extracted_number = int(last_part)
-                    user_id = extracted_number
-                except ValueError:
-                    user_id = None
-
-            #Extract repos' html url
-            html_element = repo_element.find('a', itemprop= 'name codeRepository')
-            html_url = html_element["href"] if html_element else None
-            repo['html_url'] = f'https://github.com{html_url}'
-
-            # Creating 2nd layer of scraper url to scrape data from each repo's endpoint
-            layered_url = f'https://github.com{html_url}'
-
-            #Extract repos' private
-            private_element = repo_element.find('span', class_='Label Label--secondary v-align-middle ml-1 mb-1')
-            checker = private_element.text.strip() if private_element else None
-            if checker == 'Public':
-                repo['private'] = bool(1)
-            else:
-                repo['private'] = bool(0)
-
-            #Extract repos' description
-            description_element = repo_element.find('p', itemprop='description')
-            repo['description'] = description_element.text.strip() if description_element else None
-
-            #Extract repos' fork
-            fork = scrape_repo_fork(layered_url)
-            if fork is not None:
-                repo['fork'] = bool(fork)
-            else:
-                repo['fork'] = None
-
-            #Extract repos' url
-            url_element = repo_element.find('a', itemprop= 'name codeRepository')
-            url = html_element['href'] if html_element else None
-            repo['url'] = f'https://api.github.com/repos{url}'
-
-            #Extract repos' homepage
-            homepage = scrape_repo_homepage(layered_url)
-            repo['homepage'] = homepage
-
-            #Extract repos' language
-            language_element = repo_element.find('span', itemprop='programmingLanguage')
-            repo['language'] = language_element.text.strip() if language_element else None
-
-            #Extract repos' forks count
-            forks_num = scrape_repo_forks_count(layered_url)
-            if forks_num is not None:
-                repo['forks_count'] = convert_k_to_zeros(forks_num)
-            else:
-                repo['forks_count'] = None
-
-            #Extract repos' stargazers count
-            stargazers_num = scrape_repo_stargazers_count(layered_url)
-            if stargazers_num is not None:
-                repo['stargazers_count'] = convert_k_to_zeros(stargazers_num)
-            else:
-                repo['stargazers_count'] = None
-
-            #Extract repos' watchers count
-            if stargazers_num is not None:
-                repo['watchers_count'] = convert_k_to_zeros(stargazers_num)
-            else:
-                repo['watchers_count'] = None
-            
-
-            #Extract repos' default branch
-            default_branch = scrape_repo_default_branch(layered_url)
-            repo['default_branch'] = default_branch
-
-            #Extract repos' open issues count and has_issues field
-            open_issues_num = scrape_repo_open_issues_count(layered_url)
-            if open_issues_num is not None:
-                open_issues_num = convert_k_to_zeros(open_issues_num)
-                repo['open_issues_count'] = open_issues_num
-                if open_issues_num > 0:
-                    repo['has_issues'] = bool(1)
-                else:
-                    repo['has_issues'] = bool(0)
-            else:
-                repo['open issues count'] = 0
-                repo['has_issues'] = bool(0)
-
-            #Extract repos' topics
-            topics = []
-            topic_elements = repo_element.find_all('a', class_='topic-tag topic-tag-link f6 my-1')
-            for topic_elem in topic_elements:
-                topics.append(topic_elem.text.strip())
-            repo['topics'] = topics
-
-            #Extract repos' has projects
-            projects_num = scrape_repo_has_projects(layered_url)
-            if projects_num is not None:
-                projects_num = convert_k_to_zeros(projects_num)
-                if projects_num > 0:
-                    repo['has_projects'] = bool(1)
-                else:
-                    repo['has_projects'] = bool(0)
-            else:
-                repo['has_projects'] = None
-
-            #Extract repos' has discussions
-            discussions = scrape_repo_discussions(layered_url)
-            if discussions is not None:
-                repo['has_discussions'] = bool(1)
-            else:
-                repo['has_discussions'] = bool(0)
-
-            #Extract repos' archived
-            archive_element = repo_element.find('span', class_='Label Label--secondary v-align-middle ml-1 mb-1')
-            archive_element = private_element.text.strip() if archive_element else None
-            checker = "archive"
-            if archive_element is not None:
-                if checker in archive_element:
-                    repo['archived'] = bool(1)
-                else:
-                    repo['archived'] = bool(0)
+@scrape_cache.cached('org_repos', serve_stale=True, cacheable=is_complete)
+def scrape_org_repo(url,username,per_page,sort_by,direction,page,fields=None):
+    repos = iter_org_repo(url, username, per_page, sort_by, direction, page, fields)
+    return list(repos) if repos is not None else None
+
+#Streaming variant of scrape_org_repo (see scrape_cache.cached), returns None or an iterator of the repos
+def stream_org_repo(url,username,per_page,sort_by,direction,page,fields=None):
+    return scrape_org_repo.stream(iter_org_repo, url, username, per_page, sort_by, direction, page, fields)
+
+#See iter_user_repo
+def iter_org_repo(url,username,per_page,sort_by,direction,page,fields=None):
+    page_repos_list, listing = scrape_listing(url, ORG_REPO_ROW, per_page, sort_by, direction, page)
+    if listing is None:     #GitHub API documentation specified 200 as a successful response
+        return None
+
+    # Scrape the 2nd layer of every repo on this page concurrently, results keep the page order
+    repo_pages = iter_repo_pages_for_fields(listing_layered_urls(page_repos_list), fields, listing_pushed_dates(page_repos_list))
+    return (mark_unavailable(select_fields(build_org_repo(row, repo_page), fields), repo_page) for row, repo_page in zip(page_repos_list, repo_pages))
+
+#Builds the repo dict of one row (ListingRow) of an organisation's listing from the row and the fields of the repo's own page
+@metrics.timed('build_org_repo')
+def build_org_repo(row, repo_page):
+    repo = {}
 
-            #Extract repos' pushed at date
-            pushed_element = repo_element.find('relative-time')
-            repo['pushed_at'] = pushed_element["datetime"] if pushed_element else None
+    #Extract repos' name and full name
+    repo['name'] = row.name
+    repo['full_name'] = row.href
 
-            org_repo_list.append(repo)
-        return org_repo_list
+    #Extract repos' html url
+    repo['html_url'] = f'https://github.com{row.href}'
+
+
+    #Extract repos' private
+    if row.label == 'Public':
+        repo['private'] = bool(1)
     else:
-        return None
+        repo['private'] = bool(0)
 
-    
-def scrape_repo_homepage(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        homepage_element = soup.find('a',class_= 'mr-lg-3 color-fg-inherit flex-order-2', )
-        homepage = homepage_element.text.strip() if homepage_element else None
-        return homepage
+    #Extract repos' description
+    repo['description'] = row.description
+
+    #Extract repos' fork
+    fork = repo_page['fork']
+    if fork is not None:
+        repo['fork'] = bool(fork)
     else:
-        return None
+        repo['fork'] = None
 
-def scrape_repo_discussions(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        discussions_element = soup.find('a', id="discussions-tab")
-        return discussions_element
+    #Extract repos' url
+    repo['url'] = f'https://api.github.com/repos{row.href}'
+
+    #Extract repos' homepage
+    homepage = repo_page['homepage']
+    repo['homepage'] = homepage
+
+    #Extract repos' language
+    repo['language'] = row.language
+
+    #Extract repos' forks count
+    forks_num = repo_page['forks_count']
+    if forks_num is not None:
+        repo['forks_count'] = convert_k_to_zeros(forks_num)
     else:
-        return None
-    
-def scrape_repo_fork(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        fork_element = soup.find('meta', {'name': 'octolytics-dimension-repository_is_fork'})
-        fork = fork_element["content"] if fork_element else None
-        if fork == 'true':
-            fork = 1
+        repo['forks_count'] = None
+
+    #Extract repos' stargazers count
+    stargazers_num = repo_page['stargazers_count']
+    if stargazers_num is not None:
+        repo['stargazers_count'] = convert_k_to_zeros(stargazers_num)
+    else:
+        repo['stargazers_count'] = None
+
+    #Extract repos' watchers count
+    if stargazers_num is not None:
+        repo['watchers_count'] = convert_k_to_zeros(stargazers_num)
+    else:
+        repo['watchers_count'] = None
+
+
+    #Extract repos' default branch
+    default_branch = repo_page['default_branch']
+    repo['default_branch'] = default_branch
+
+    #Extract repos' open issues count and has_issues field
+    open_issues_num = repo_page['open_issues_count']
+    if open_issues_num is not None:
+        open_issues_num = convert_k_to_zeros(open_issues_num)
+        repo['open_issues_count'] = open_issues_num
+        if open_issues_num > 0:
+            repo['has_issues'] = bool(1)
+        else:
+            repo['has_issues'] = bool(0)
+    else:
+        repo['open issues count'] = 0
+        repo['has_issues'] = bool(0)
+
+    #Extract repos' topics
+    repo['topics'] = list(row.topics)
+
+    #Extract repos' has projects
+    projects_num = repo_page['has_projects']
+    if projects_num is not None:
+        projects_num = convert_k_to_zeros(projects_num)
+        if projects_num > 0:
+            repo['has_projects'] = bool(1)
         else:
-            fork = 0
-        return fork
+            repo['has_projects'] = bool(0)
     else:
-        return None 
+        repo['has_projects'] = None
 
-def scrape_repo_id(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        id_element = soup.find('meta', {'name': 'octolytics-dimension-repository_network_root_id'})
-        id = id_element["content"] if id_element else None
-        return id
+    #Extract repos' has discussions
+    discussions = repo_page['discussions']
+    if discussions is not None:
+        repo['has_discussions'] = bool(1)
     else:
-        return None
+        repo['has_discussions'] = bool(0)
+
+    #Extract repos' archived
+    checker = "archive"
+    if row.label is not None:
+        if checker in row.label:
+            repo['archived'] = bool(1)
+        else:
+            repo['archived'] = bool(0)
+
+    #Extract repos' pushed at date
+    repo['pushed_at'] = row.pushed_at
+
+    return repo
+
+
+
+#Fields scraped from the 2nd layer (the repo's own page), all read from a single download
+REPO_PAGE_FIELDS = ('id', 'fork', 'homepage', 'forks_count', 'stargazers_count', 'default_branch', 'open_issues_count', 'has_projects', 'discussions')
+
+#Function for scraping every 2nd layer field of a repo with one request and one parse
+@scrape_cache.cached('repo_page')
+def scrape_repo_page(url):
+    return fetch_and_extract(url, extract_repo_page)
+
+#Extraction plan of the repo page (see extraction_plan.py), every row is the soup.find() that used to read the field
+REPO_PAGE_PLAN = ExtractionPlan([
+    ('id', Selector('meta', name='octolytics-dimension-repository_network_root_id'), attribute('content')),
+    ('fork', Selector('meta', name='octolytics-dimension-repository_is_fork'), attribute('content')),
+    ('homepage', Selector('a', class_='mr-lg-3 color-fg-inherit flex-order-2'), text),
+    ('forks_count', Selector('span', id='repo-network-counter'), text),
+    ('stargazers_count', Selector('span', id='repo-stars-counter-star'), text),
+    ('default_branch', Selector('span', class_='css-truncate-target'), text),
+    ('open_issues_count', Selector('span', id='issues-repo-tab-count'), text),
+    ('has_projects', Selector('span', class_='Counter', id='projects-repo-tab-count', hidden='hidden'), text),
+    ('discussions', Selector('a', id='discussions-tab'), present),
+])
+
+def extract_repo_page(soup):
+    repo_page = REPO_PAGE_PLAN.evaluate(soup)
+
+    #The fork flag is a meta tag holding 'true' or 'false'
+    repo_page['fork'] = 1 if repo_page['fork'] == 'true' else 0
+
+    #No projects counter means no projects
+    if repo_page['has_projects'] is None:
+        repo_page['has_projects'] = 0
+
+    return repo_page
+
+#Scrapes the pages of several repos on the shared worker pool and returns their fields in the order of urls.
+#A repo that fails or is still pending when ENRICH_TIMEOUT (or the request's deadline) runs out gets unavailable fields
+#instead of failing the whole page.
+def scrape_repo_pages(urls):
+    return list(iter_repo_pages(urls))
+
+#Same as scrape_repo_pages, but the pages are submitted right away and the returned generator yields each one as it is done.
+#With the incremental crawl on, the repos not pushed to since they were stored are taken from the store (scrape_store.py).
+def iter_repo_pages(urls, pushed_dates=None):
+    stored_pages = scrape_store.stored_repo_pages(urls, pushed_dates)
+    executor = get_enrich_executor()
+    futures = [executor.submit(contextvars.copy_context().run, scrape_repo_page, url) for url, stored_page in zip(urls, stored_pages) if stored_page is None]
+    scraped_pages = wait_repo_pages(futures, request_deadline.earliest(time.monotonic() + ENRICH_TIMEOUT))
+    return scrape_store.merge_repo_pages(urls, pushed_dates, stored_pages, scraped_pages)
+
+def wait_repo_pages(futures, deadline):
+    for future in futures:
+        try:
+            repo_page = future.result(timeout=max(0, deadline - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            repo_page = None
+        except rate_limit.UpstreamBusy:
+            raise
+        except Exception:
+            repo_page = None
+
+        if repo_page is None:
+            repo_page = unavailable_repo_page()
+        yield repo_page
+
+#Tags read by extract_repo_page, everything else on the repo page (file list, README, ...) is never built
+REPO_PAGE_META_NAMES = ('octolytics-dimension-repository_network_root_id', 'octolytics-dimension-repository_is_fork')
+REPO_PAGE_SPAN_IDS = ('repo-network-counter', 'repo-stars-counter-star', 'issues-repo-tab-count', 'projects-repo-tab-count')
+
+def is_repo_page_tag(name, attrs):
+    classes = (attrs.get('class') or '').split()
+    if name == 'meta':
+        return attrs.get('name') in REPO_PAGE_META_NAMES
+    if name == 'span':
+        return attrs.get('id') in REPO_PAGE_SPAN_IDS or 'css-truncate-target' in classes
+    if name == 'a':
+        return attrs.get('id') == 'discussions-tab' or 'flex-order-2' in classes
+    return False
+
+extract_repo_page.parse_only = SoupStrainer(is_repo_page_tag)
+extract_repo_page.stop_plan = REPO_PAGE_PLAN
+
+#The per-field functions below are kept as thin wrappers over scrape_repo_page
+def scrape_repo_field(url, field):
+    repo_page = scrape_repo_page(url)
+    return repo_page[field] if repo_page is not None else None
+
+def scrape_repo_homepage(url):
+    return scrape_repo_field(url, 'homepage')
+
+def scrape_repo_discussions(url):
+    return scrape_repo_field(url, 'discussions')
+
+def scrape_repo_fork(url):
+    return scrape_repo_field(url, 'fork')
+
+def scrape_repo_id(url):
+    return scrape_repo_field(url, 'id')
 
 def scrape_repo_forks_count(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        forks_count_element = soup.find('span', id= 'repo-network-counter')
-        forks_num = forks_count_element.text.strip() if forks_count_element else None
-        return forks_num
-    else:
-        return None
+    return scrape_repo_field(url, 'forks_count')
 
-    
 def scrape_repo_stargazers_count(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        stargazers_element = soup.find('span', id='repo-stars-counter-star')
-        stargazers_num = stargazers_element.text.strip() if stargazers_element else None
-        return stargazers_num
-    else:
-        return None
-    
+    return scrape_repo_field(url, 'stargazers_count')
 
 def scrape_repo_has_projects(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        projects_element = soup.find('span', id='projects-repo-tab-count',hidden='hidden', class_='Counter')
-        projects_num = projects_element.text.strip() if projects_element else 0 #or NONE
-        return projects_num
-    else:
-        return None
+    return scrape_repo_field(url, 'has_projects')
 
 def scrape_repo_default_branch(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        default_element = soup.find('span', class_='css-truncate-target')
-        default_branch = default_element.text.strip() if default_element else None
-        return default_branch
-    else:
-        return None
-    
+    return scrape_repo_field(url, 'default_branch')
+
 def scrape_repo_open_issues_count(url):
-    response = get_with_backoff(url)
-    if response.status_code == 200:     #GitHub API documentation specified 200 as a successful response
-        soup = BeautifulSoup(response.content, 'html.parser')
-        open_issues_element = soup.find('span', id='issues-repo-tab-count')
-        open_issues_num = open_issues_element.text.strip() if open_issues_element else None
-        return open_issues_num
-    else:
+    return scrape_repo_field(url, 'open_issues_count')
+
+#Extracts the account id from an avatar url such as https://avatars.githubusercontent.com/u/583231?v=4
+def avatar_url_to_id(avatar_url):
+    if avatar_url is None:
+        return None
+    # Extracting the numeric value after the last '/' and removing a query parameter (?v=4)
+    last_part = avatar_url.split('/')[-1].split('?')[0]
+    try:
+        return int(last_part)
+    except ValueError:
         return None
 
 def convert_k_to_zeros(input_str):
@@ -0,0 +1,107 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.request import ACCEPT_ENCODING     #"gzip,deflate", plus ",br" when a brotli package is installed
+
+#Settings of the shared HTTP client, configurable through the environment
+POOL_CONNECTIONS = int(os.environ.get('GITHUB_SCRAPER_POOL_CONNECTIONS', 4))    #Number of per-host connection pools kept
+POOL_MAXSIZE = int(os.environ.get('GITHUB_SCRAPER_POOL_MAXSIZE', 16))           #Keep-alive connections kept per host
+CONNECT_TIMEOUT = float(os.environ.get('GITHUB_SCRAPER_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('GITHUB_SCRAPER_READ_TIMEOUT', 20))
+
+_stats = {"requests": 0, "pool_checkouts": 0, "pool_misses": 0, "connects": 0, "tls_handshakes": 0}
+_stats_lock = threading.Lock()
+
+def count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+#Connection counters: a checkout that does not need a new connection is a pool hit,
+#every (re)connect opens a TCP connection and, for https, does a TLS handshake
+class CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        count('connects')
+        super().connect()
+
+class CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        count('connects')
+        count('tls_handshakes')
+        super().connect()
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = CountingHTTPConnection
+
+    def _get_conn(self, timeout=None):
+        count('pool_checkouts')
+        return super()._get_conn(timeout)
+
+    def _new_conn(self):
+        count('pool_misses')
+        return super()._new_conn()
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = CountingHTTPSConnection
+
+    def _get_conn(self, timeout=None):
+        count('pool_checkouts')
+        return super()._get_conn(timeout)
+
+    def _new_conn(self):
+        count('pool_misses')
+        return super()._new_conn()
+
+class PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+#The adapter (and with it the connection pool) is shared by every thread of a process.
+#Each thread gets its own Session on top of it, so cookies and headers are never shared between threads.
+_adapter = None
+_adapter_pid = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
+
+def get_adapter():
+    global _adapter, _adapter_pid
+    with _adapter_lock:
+        #A forked worker process must not reuse the sockets of its parent
+        if _adapter is None or _adapter_pid != os.getpid():
+            _adapter = PooledAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            _adapter_pid = os.getpid()
+        return _adapter
+
+#Replaces the transport used by every session, e.g. with a replay adapter serving saved pages
+def set_adapter(adapter):
+    global _adapter, _adapter_pid
+    with _adapter_lock:
+        _adapter = adapter
+        _adapter_pid = os.getpid()
+
+def get_session():
+    adapter = get_adapter()
+    session = getattr(_local, 'session', None)
+    if session is None or session.get_adapter('https://') is not adapter:
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        session.headers['Connection'] = 'keep-alive'
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _local.session = session
+    return session
+
+def get(url, **kwargs):
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+    count('requests')
+    return get_session().get(url, **kwargs)
+
+def pool_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["pool_hits"] = stats["pool_checkouts"] - stats["pool_misses"]
+    stats["accept_encoding"] = ACCEPT_ENCODING
+    return stats
@@ -0,0 +1,79 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import requests
+from fixture_server import FixtureServer
+
+#Load test of the API against the local fixture server, in development (python github_api.py) or production (python serve.py) mode
+DEFAULT_PATHS = ['/users/octocat', '/users/github', '/users/octocat/repos?per_page=10', '/users/github/repos?per_page=10&sort=pushed']
+
+def start_api(mode, port, fixture_url, extra_env):
+    env = dict(os.environ, GITHUB_API_PORT=str(port), GITHUB_SCRAPER_GITHUB_URL=fixture_url, **extra_env)
+    script = 'serve.py' if mode == 'prod' else 'github_api.py'
+    process = subprocess.Popen([sys.executable, script], env=env, cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/stats', timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'API did not start in {mode} mode')
+
+def run_load(port, paths, total_requests, concurrency):
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    def timed_get(i):
+        start = time.perf_counter()
+        response = session.get(f'http://127.0.0.1:{port}{paths[i % len(paths)]}', timeout=120)
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_get, range(total_requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, status in results)
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+    return {
+        "requests": total_requests,
+        "errors": sum(1 for latency, status in results if status != 200),
+        "throughput_rps": round(total_requests / elapsed, 1),
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the API against the local fixture server')
+    parser.add_argument('--mode', choices=['dev', 'prod', 'both'], default='both')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=50, help='simulated github.com round-trip time')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--cache', action='store_true', help='keep the scrape cache on (off by default so every call scrapes)')
+    parser.add_argument('--path', action='append', dest='paths', help='API path to request, can be repeated')
+    args = parser.parse_args()
+
+    fixture_server = FixtureServer(('127.0.0.1', 0), latency=args.latency_ms / 1000).start()
+    #The fixture server is local, the outbound rate limit is off
+    extra_env = {"GITHUB_SCRAPER_RATE": '0'}
+    if not args.cache:
+        extra_env["GITHUB_SCRAPER_CACHE"] = 'off'
+    modes = ['dev', 'prod'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        process = start_api(mode, args.port, fixture_server.url, extra_env)
+        try:
+            result = run_load(args.port, args.paths or DEFAULT_PATHS, args.requests, args.concurrency)
+        finally:
+            process.send_signal(signal.SIGTERM)     #Graceful shutdown
+            process.wait(timeout=60)
+        result["mode"] = mode
+        print(json.dumps(result))
@@ -0,0 +1,169 @@
+import time
+import bisect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+#Instrumentation of the hot path: how long each stage of a scrape takes (upstream round-trips, waits for the rate limit
+#or a retry, HTML parsing and every extractor), with the requests, bytes and retries sent upstream. Every stage is
+#added to the process wide histograms of GET /metrics and to the spans of the API request it runs for (Server-Timing).
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)      #Seconds
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+_histograms = {}        #(name, labels) -> Histogram
+_counters = {}          #(name, labels) -> value
+_metrics_lock = threading.Lock()
+
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+def count(name, amount=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+#Spans of one API request: stage -> [seconds, count]. The worker threads and engine tasks working for the request run in a
+#copy of its context and share them, so the seconds of a stage are summed over them and can be more than the request took.
+class Spans:
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            span = self.stages.setdefault(stage, [0.0, 0])
+            span[0] += seconds
+            span[1] += 1
+
+    def server_timing(self):
+        with self.lock:
+            return ', '.join(f'{stage};dur={seconds * 1000:.1f};desc="{count}x"' for stage, (seconds, count) in self.stages.items())
+
+_spans = contextvars.ContextVar('spans', default=None)
+
+#Starts collecting the spans of the current context
+def track_spans():
+    spans = Spans()
+    _spans.set(spans)
+    return spans
+
+def current_spans():
+    return _spans.get()
+
+def set_spans(spans):
+    _spans.set(spans)
+
+def record(stage, seconds):
+    observe('github_scraper_stage_seconds', seconds, stage=stage)
+    spans = _spans.get()
+    if spans is not None:
+        spans.add(stage, seconds)
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+#Decorator recording every call of the function as a span of stage
+def timed(stage):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+#Seconds about to be slept for the rate limit or before a retry
+def record_wait(seconds):
+    if seconds > 0:
+        record('wait', seconds)
+
+#One answer from GitHub, counted by status
+def count_upstream(status, content):
+    count('github_scraper_upstream_requests_total', status=str(status))
+    count('github_scraper_upstream_bytes_total', len(content))
+
+def count_retry():
+    count('github_scraper_upstream_retries_total')
+
+#A page whose download was stopped early by the streaming fetch after received bytes, of length (None when not announced)
+def count_truncated(length, received):
+    count('github_scraper_upstream_truncated_total')
+    if length is not None:
+        count('github_scraper_upstream_bytes_saved_total', max(0, length - received))
+
+def counter(name, **labels):
+    with _metrics_lock:
+        return _counters.get((name, tuple(sorted(labels.items()))), 0)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+#Numbers of /stats that are current values (sizes, settings, calls in progress), exposed as gauges. The others only
+#ever grow, they are exposed as counters with a _total suffix so rate() works on them.
+STATS_GAUGES = {
+    "cache": ('entries', 'hot_keys', 'hit_ratio'),
+    "single_flight": ('in_flight', 'waiting'),
+    "rate_limit": ('rate', 'paused_for'),
+    "store": ('users', 'repos'),
+    "parse": ('processes', 'inline_bytes'),
+}
+
+#Prometheus text exposition of the histograms and counters, plus the numbers of /stats under their group
+def exposition(stats=None):
+    with _metrics_lock:
+        histograms = {key: (list(histogram.counts), histogram.sum, histogram.count) for key, histogram in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = []
+    for name in sorted({name for name, labels in histograms}):
+        lines.append(f'# TYPE {name} histogram')
+        for (histogram_name, labels), (counts, total, observations) in sorted(histograms.items()):
+            if histogram_name != name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total:.6f}')
+            lines.append(f'{name}_count{format_labels(labels)} {observations}')
+    counter_names = {name for name, labels in counters}
+    for name in sorted(counter_names):
+        lines.append(f'# TYPE {name} counter')
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f'{name}{format_labels(labels)} {value}')
+    for group, values in sorted((stats or {}).items()):
+        for key, value in sorted(values.items()):
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            if key in STATS_GAUGES.get(group, ()):
+                lines.append(f'# TYPE github_scraper_{group}_{key} gauge')
+                lines.append(f'github_scraper_{group}_{key} {value}')
+            #A number /stats reads from the counters above (e.g. parse offloaded) is already exposed
+            elif f'github_scraper_{group}_{key}_total' not in counter_names:
+                lines.append(f'# TYPE github_scraper_{group}_{key}_total counter')
+                lines.append(f'github_scraper_{group}_{key}_total {value}')
+    return '\n'.join(lines) + '\n'
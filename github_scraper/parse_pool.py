@@ -0,0 +1,93 @@
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from bs4 import BeautifulSoup
+import metrics
+import request_deadline
+
+#Parse executor: BeautifulSoup and the extractors are pure Python, so the pages parsed by the worker threads (or on the
+#engine's loop) take turns on the GIL. With GITHUB_SCRAPER_PARSE_PROCESSES > 0, the raw bytes of a page are sent to a
+#pool of processes instead, which parse it, run the extractor and send back only the small extracted result.
+PARSE_PROCESSES = int(os.environ.get('GITHUB_SCRAPER_PARSE_PROCESSES', 0))          #Size of the pool, 0 parses inline
+PARSE_INLINE_BYTES = int(os.environ.get('GITHUB_SCRAPER_PARSE_INLINE_BYTES', 32768))  #Smaller pages are still parsed inline
+
+_parse_executor = None
+_parse_executor_pid = None
+_parse_executor_lock = threading.Lock()
+
+#Pool shared by all API calls, created on first use (and again in a forked worker process). Its processes are spawned,
+#not forked from a process running threads, and import the extractors' module on their first page.
+def get_parse_executor():
+    global _parse_executor, _parse_executor_pid
+    with _parse_executor_lock:
+        if _parse_executor is None or _parse_executor_pid != os.getpid():
+            _parse_executor = concurrent.futures.ProcessPoolExecutor(max_workers=PARSE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+            _parse_executor_pid = os.getpid()
+        return _parse_executor
+
+#Drops a pool whose process died, the next page starts a new one
+def reset_parse_executor(executor):
+    global _parse_executor
+    with _parse_executor_lock:
+        if _parse_executor is executor:
+            _parse_executor = None
+    executor.shutdown(wait=False)
+
+#True when a page of that many bytes is parsed in the pool
+def offloaded(content):
+    return PARSE_PROCESSES > 0 and len(content) >= PARSE_INLINE_BYTES
+
+#Runs in a pool process (or inline): returns extractor(soup, *args) with the seconds the parse and the extractor took.
+#extractor is sent by reference, it must be a module level function.
+def parse_and_extract(content, parser, parse_only, extractor, args):
+    start = time.perf_counter()
+    soup = BeautifulSoup(content, parser, parse_only=parse_only)
+    parsed = time.perf_counter()
+    result = extractor(soup, *args)
+    return result, parsed - start, time.perf_counter() - parsed
+
+#The times measured in the pool count as the spans of the request
+def record(extractor, outcome):
+    result, parse_seconds, extract_seconds = outcome
+    metrics.record('parse', parse_seconds)
+    metrics.record(extractor.__name__, extract_seconds)
+    return result
+
+#Parses content in the pool and returns the extracted result, waiting no longer than the request's deadline.
+#A pool that broke (a process was killed) is replaced, and that page is parsed inline.
+def extract(content, parser, parse_only, extractor, args):
+    executor = get_parse_executor()
+    metrics.count('github_scraper_parse_offloaded_total')
+    try:
+        future = executor.submit(parse_and_extract, content, parser, parse_only, extractor, args)
+        try:
+            outcome = future.result(timeout=request_deadline.remaining())
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise request_deadline.DeadlineExceeded('Request deadline passed while parsing')
+    except BrokenProcessPool:
+        reset_parse_executor(executor)
+        outcome = parse_and_extract(content, parser, parse_only, extractor, args)
+    return record(extractor, outcome)
+
+#Same as extract, awaited by the asyncio engine, whose loop keeps running while the pool parses
+async def extract_async(content, parser, parse_only, extractor, args):
+    executor = get_parse_executor()
+    metrics.count('github_scraper_parse_offloaded_total')
+    try:
+        future = executor.submit(parse_and_extract, content, parser, parse_only, extractor, args)
+        try:
+            outcome = await asyncio.wait_for(asyncio.wrap_future(future), request_deadline.remaining())
+        except asyncio.TimeoutError:
+            raise request_deadline.DeadlineExceeded('Request deadline passed while parsing')
+    except BrokenProcessPool:
+        reset_parse_executor(executor)
+        outcome = parse_and_extract(content, parser, parse_only, extractor, args)
+    return record(extractor, outcome)
+
+def parse_stats():
+    return {"processes": PARSE_PROCESSES, "inline_bytes": PARSE_INLINE_BYTES, "offloaded": metrics.counter('github_scraper_parse_offloaded_total')}
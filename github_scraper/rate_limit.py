@@ -0,0 +1,171 @@
+import os
+import time
+import random
+import threading
+import email.utils
+
+#Outbound request scheduler shared by every request thread and by the async engine of a process, configurable through the environment.
+#GitHub does not publish the limits of its HTML pages, the defaults stay well under the 900 requests a minute (15/s)
+#and the 100 concurrent requests of its REST API secondary rate limits. GITHUB_SCRAPER_RATE=0 turns the bucket off.
+RATE = float(os.environ.get('GITHUB_SCRAPER_RATE', 10))                 #Requests per second sent to GitHub
+BURST = float(os.environ.get('GITHUB_SCRAPER_BURST', 20))               #Requests that can be sent at once after an idle period
+MAX_WAIT = float(os.environ.get('GITHUB_SCRAPER_MAX_WAIT', 10))         #Seconds a request may queue for a token before it is refused
+MAX_TRIES = int(os.environ.get('GITHUB_SCRAPER_MAX_TRIES', 3))          #Attempts of a request failing with a transient error
+RETRY_BASE = float(os.environ.get('GITHUB_SCRAPER_RETRY_BASE', 0.5))    #Seconds, doubled on every retry (full jitter)
+RETRY_MAX = float(os.environ.get('GITHUB_SCRAPER_RETRY_MAX', 10))       #Seconds, cap of a single back-off
+
+#Answers worth another attempt, any other error status is final (a 404 is a missing user or repo)
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+#Pause when GitHub rate limits without telling for how long, as its documentation advises
+DEFAULT_PAUSE = 60
+
+_stats = {"requests": 0, "waited_seconds": 0.0, "rejected": 0, "retries": 0, "pauses": 0}
+_stats_lock = threading.Lock()
+
+def count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+#Raised instead of queueing or retrying any longer, the API answers it right away with status and a Retry-After header:
+#429 while GitHub is rate limiting us, 503 when more requests are queued than the bucket lets through within MAX_WAIT
+class UpstreamBusy(Exception):
+    def __init__(self, status, retry_after):
+        super().__init__(f'GitHub is {"rate limiting" if status == 429 else "busy"}, retry after {retry_after} seconds')
+        self.status = status
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate=RATE, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()     #Tokens are added from this moment on, it lies in the future during a pause
+        self.paused = False
+        self.lock = threading.Lock()
+
+    #Takes a token and returns the seconds to sleep before using it, tokens can be taken ahead (the count goes negative)
+    #so concurrent callers are spread over time. Raises UpstreamBusy when that would be more than max_wait.
+    def reserve(self, max_wait):
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.updated:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                self.paused = False
+            wait = self.updated - now
+            if self.tokens < 1:
+                wait += (1 - self.tokens) / self.rate
+            if wait > max_wait:
+                count('rejected')
+                raise UpstreamBusy(429 if self.paused else 503, max(1, round(wait)))
+            self.tokens -= 1
+        count('requests')
+        count('waited_seconds', wait)
+        return wait
+
+    #No token is handed out for the next seconds
+    def pause(self, seconds):
+        with self.lock:
+            self.tokens = min(self.tokens, 0)
+            self.updated = max(self.updated, time.monotonic() + seconds)
+            self.paused = True
+        count('pauses')
+
+    def paused_for(self):
+        with self.lock:
+            return max(0, self.updated - time.monotonic()) if self.paused else 0
+
+_bucket = None
+_bucket_ready = False
+_bucket_lock = threading.Lock()
+
+def get_bucket():
+    global _bucket, _bucket_ready
+    with _bucket_lock:
+        if not _bucket_ready:
+            _bucket = TokenBucket() if RATE > 0 else None
+            _bucket_ready = True
+        return _bucket
+
+#Replaces the token bucket, None sends requests unlimited (e.g. against a local fixture server)
+def set_bucket(bucket):
+    global _bucket, _bucket_ready
+    with _bucket_lock:
+        _bucket = bucket
+        _bucket_ready = True
+
+#Seconds to wait before sending the next request, see TokenBucket.reserve
+def acquire():
+    bucket = get_bucket()
+    return bucket.reserve(MAX_WAIT) if bucket is not None else 0
+
+#Retry-After holds either seconds or an HTTP date
+def parse_retry_after(value):
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+#Seconds GitHub asks us to stop for, None when the answer is no rate limit
+def rate_limit_pause(status, headers):
+    retry_after = parse_retry_after(headers.get('Retry-After'))
+    if status in (403, 429, 503) and retry_after is not None:
+        return retry_after
+    if status in (403, 429) and headers.get('X-RateLimit-Remaining') == '0':
+        reset = headers.get('X-RateLimit-Reset', '')
+        return max(0, int(reset) - time.time()) if reset.isdigit() else DEFAULT_PAUSE
+    if status == 429:
+        return DEFAULT_PAUSE
+    return None
+
+#Exponential back-off with full jitter, so requests failing together do not all come back together
+def backoff_delay(attempt):
+    return random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+
+#Decides what follows attempt number attempt (from 1) of a request answered with status. Returns None when the answer is
+#final, else the seconds to sleep before the next attempt (a rate limit pauses the bucket, which is then waited out in acquire).
+#Raises UpstreamBusy when a rate limited or unavailable request is out of attempts.
+#The caller counts the retry (retried) once it is actually going to send it.
+def response_retry_delay(attempt, status, headers):
+    pause = rate_limit_pause(status, headers)
+    bucket = get_bucket()
+    if pause is not None and bucket is not None:
+        bucket.pause(pause)
+    if status not in TRANSIENT_STATUSES and pause is None:
+        return None
+
+    if attempt >= MAX_TRIES:
+        if pause is not None:
+            raise UpstreamBusy(429, max(1, round(pause)))
+        if status == 503:
+            raise UpstreamBusy(503, max(1, round(min(RETRY_MAX, RETRY_BASE * 2 ** attempt))))
+        return None
+    #A pause longer than a request may queue is not waited out, the request (and the next ones) get a 429 right away
+    if pause is not None and pause > MAX_WAIT:
+        raise UpstreamBusy(429, round(pause))
+    if pause is None:
+        return backoff_delay(attempt)
+    return 0 if bucket is not None else pause
+
+#Same as response_retry_delay for a request that failed to connect or timed out, None means out of attempts
+def error_retry_delay(attempt):
+    if attempt >= MAX_TRIES:
+        return None
+    return backoff_delay(attempt)
+
+def retried():
+    count('retries')
+
+def rate_limit_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["waited_seconds"] = round(stats["waited_seconds"], 3)
+    bucket = get_bucket()
+    stats["rate"] = bucket.rate if bucket is not None else None
+    stats["paused_for"] = round(bucket.paused_for(), 3) if bucket is not None else 0
+    return stats
@@ -0,0 +1,71 @@
+import argparse
+import json
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+import http_client
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+#Transport adapter recording the pages downloaded through get_with_backoff: every 200 answer is saved to fixtures_dir
+#and added to its index.json, so benchmark.py and fixture_server.py can replay the same pages offline later.
+class FixtureRecorder(http_client.PooledAdapter):
+    def __init__(self, fixtures_dir=FIXTURES_DIR, **kwargs):
+        super().__init__(pool_connections=http_client.POOL_CONNECTIONS, pool_maxsize=http_client.POOL_MAXSIZE, **kwargs)
+        self.fixtures_dir = fixtures_dir
+        self.index_path = os.path.join(fixtures_dir, 'index.json')
+        os.makedirs(fixtures_dir, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        self.recorded = 0
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        if response.status_code == 200:
+            self.save(request.url, response.content)
+        return response
+
+    def save(self, url, content):
+        file_name = fixture_name(url)
+        with open(os.path.join(self.fixtures_dir, file_name), 'wb') as f:
+            f.write(content)
+        with self.lock:
+            self.index[url] = file_name
+            self.recorded += 1
+            with open(self.index_path, 'w') as f:
+                json.dump(self.index, f, indent=2, sort_keys=True)
+
+    def install(self):
+        http_client.set_adapter(self)
+
+#File name of the page at url, e.g. orgs_github_repositories_page_2.html for https://github.com/orgs/github/repositories?page=2
+def fixture_name(url):
+    parts = urlsplit(url)
+    name = re.sub(r'[^A-Za-z0-9]+', '_', f'{parts.path} {parts.query}').strip('_')
+    return f'{name or "index"}.html'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record the GitHub pages scraped for API calls as replayable fixtures')
+    parser.add_argument('paths', nargs='+', help='API paths to call, e.g. /users/octocat "/users/github/repos?per_page=10"')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR)
+    args = parser.parse_args()
+
+    #Every page has to be downloaded to be recorded: synchronous engine (the recorder sits in its transport), no cache and
+    #no store of already scraped repo pages. Pages are read to the end, the streaming fetch would save them truncated.
+    os.environ['GITHUB_SCRAPER_ASYNC'] = '0'
+    os.environ['GITHUB_SCRAPER_STREAM_FETCH'] = '0'
+    os.environ['GITHUB_SCRAPER_INCREMENTAL'] = '0'
+    import github_api
+    import scrape_cache
+    recorder = FixtureRecorder(args.fixtures)
+    recorder.install()
+    scrape_cache.set_backend(None)
+
+    client = github_api.app.test_client()
+    for path in args.paths:
+        status = client.get(path).status_code
+        print(json.dumps({"path": path, "status": status, "recorded": recorder.recorded}))
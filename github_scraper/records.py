@@ -0,0 +1,47 @@
+from collections import namedtuple
+
+#Compact records of the results kept in the memory cache with GITHUB_SCRAPER_CACHE_COMPACT=1 (the scraped users, owners,
+#repos and repo pages). A record holds the values of a dict in a tuple, and its keys in a shape shared by every record
+#with the same keys, instead of a hash table per dict. The scrapers and the responses only ever see plain dicts, records
+#are built when a result is stored (compact) and turned back into dicts when it is read (expand).
+
+#Keys of a record in order, and those holding a nested record
+Shape = namedtuple('Shape', ('keys', 'nested'))
+
+_shapes = {}
+
+def shape_of(keys, nested):
+    return _shapes.setdefault((keys, nested), Shape(keys, nested))
+
+class Record:
+    __slots__ = ('shape', 'values')
+
+    def __init__(self, items):
+        self.shape = shape_of(tuple(items), tuple(key for key, value in items.items() if type(value) is dict))
+        self.values = tuple(Record(value) if type(value) is dict else value for value in items.values())
+
+    #One dict built from the shared keys, then the nested records
+    def to_dict(self):
+        items = dict(zip(self.shape.keys, self.values))
+        for key in self.shape.nested:
+            items[key] = items[key].to_dict()
+        return items
+
+    def __repr__(self):
+        return f'Record({self.to_dict()!r})'
+
+#Value to store for a result: its dicts, and the dicts of a list of them, become records
+def compact(value):
+    if type(value) is dict:
+        return Record(value)
+    if type(value) is list:
+        return [Record(item) if type(item) is dict else item for item in value]
+    return value
+
+#The result a stored value stands for, with new dicts every time it is read
+def expand(value):
+    if type(value) is Record:
+        return value.to_dict()
+    if type(value) is list:
+        return [item.to_dict() if type(item) is Record else item for item in value]
+    return value
@@ -0,0 +1,47 @@
+import time
+import contextvars
+
+#Time budget of an API request. The deadline (a time.monotonic() value) is held in the request's context, which the
+#worker threads and engine tasks scraping for it run in a copy of: every download is bounded by what is left of it, and
+#the repo pages still missing when it passes are returned without their fields (see github_scraper.wait_repo_pages).
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+#Raised instead of downloading (or retrying) past the deadline, the API answers it with 504 Gateway Timeout
+class DeadlineExceeded(Exception):
+    pass
+
+#Starts a budget of seconds for the current context, None for no budget
+def start(seconds):
+    set_deadline(time.monotonic() + seconds if seconds is not None else None)
+
+def get_deadline():
+    return _deadline.get()
+
+def set_deadline(deadline):
+    _deadline.set(deadline)
+
+#Seconds left, None without a budget
+def remaining():
+    deadline = _deadline.get()
+    return max(0, deadline - time.monotonic()) if deadline is not None else None
+
+#Raises DeadlineExceeded when waiting seconds (e.g. for the rate limit or before a retry) would pass the deadline
+def check(seconds=0):
+    left = remaining()
+    if left is not None and seconds >= left:
+        raise DeadlineExceeded(f'Request deadline passed, {left:.3f} seconds were left')
+
+#timeout (seconds) bounded by what is left of the budget. Raises DeadlineExceeded when nothing is left, a timeout of 0
+#is not a valid one for the HTTP clients.
+def bounded(timeout):
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded('Request deadline passed before the download started')
+    return min(timeout, left)
+
+#The earlier of deadline and the request's deadline
+def earliest(deadline):
+    request_deadline = _deadline.get()
+    return deadline if request_deadline is None else min(deadline, request_deadline)
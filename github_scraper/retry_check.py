@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+from fixture_server import FixtureServer
+
+#Checks the retry policy of the outbound scheduler (rate_limit.py) against the fixture server scripted to answer like
+#GitHub under load: a 404 is final, 5xx answers and bodies cut off half way are retried, a Retry-After is waited out and a long rate limit pause
+#answers 429 at once. Exits with status 1 when a check fails.
+def run_checks(server, client, rate_limit):
+    failures = []
+
+    def check(name, passed, details):
+        print(f'{"ok" if passed else "FAILED"}  {name}: {details}')
+        if not passed:
+            failures.append(name)
+
+    def call(path, script=None):
+        if script is not None:
+            server.script(script[0], script[1])
+        requests_before = server.requests
+        retries_before = rate_limit.rate_limit_stats()["retries"]
+        start = time.monotonic()
+        response = client.get(path)
+        return response, server.requests - requests_before, rate_limit.rate_limit_stats()["retries"] - retries_before, time.monotonic() - start
+
+    response, upstream, retries, elapsed = call('/users/nosuch')
+    check('404 is not retried', response.status_code == 404 and upstream == 1 and retries == 0,
+          f'status {response.status_code}, {upstream} upstream requests, {retries} retries')
+
+    response, upstream, retries, elapsed = call('/users/octocat', ('/octocat', [(502, {}), (503, {})]))
+    check('5xx is retried', response.status_code == 200 and upstream == 3 and retries == 2,
+          f'status {response.status_code}, {upstream} upstream requests, {retries} retries')
+
+    response, upstream, retries, elapsed = call('/users/octocat', ('/octocat', [('truncated', {})]))
+    check('A truncated body is retried', response.status_code == 200 and upstream == 2 and retries == 1,
+          f'status {response.status_code}, {upstream} upstream requests, {retries} retries')
+
+    response, upstream, retries, elapsed = call('/users/octocat', ('/octocat', [(429, {"Retry-After": '1'})]))
+    check('Retry-After is honored', response.status_code == 200 and upstream == 2 and retries == 1 and elapsed >= 1,
+          f'status {response.status_code}, {upstream} upstream requests, {retries} retries, {elapsed:.2f}s')
+
+    response, upstream, retries, elapsed = call('/users/octocat', ('/octocat', [(429, {"Retry-After": '30'})]))
+    check('A long pause answers 429 at once', response.status_code == 429 and response.headers.get('Retry-After') == '30' and upstream == 1 and retries == 0 and elapsed < 1,
+          f'status {response.status_code}, Retry-After {response.headers.get("Retry-After")}, {upstream} upstream requests, {retries} retries, {elapsed:.2f}s')
+
+    response, upstream, retries, elapsed = call('/users/github')
+    check('Requests during the pause answer 429 at once', response.status_code == 429 and upstream == 0 and elapsed < 1,
+          f'status {response.status_code}, Retry-After {response.headers.get("Retry-After")}, {upstream} upstream requests, {elapsed:.2f}s')
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the retry policy against scripted 429/5xx answers of the fixture server')
+    parser.add_argument('--async-engine', action='store_true', help='scrape with the asyncio engine')
+    args = parser.parse_args()
+
+    server = FixtureServer(('127.0.0.1', 0)).start()
+    #Every call must reach the fixture server, and the back-off between retries is kept short
+    os.environ.update(GITHUB_SCRAPER_GITHUB_URL=server.url, GITHUB_SCRAPER_CACHE='off', GITHUB_SCRAPER_RETRY_BASE='0.01', GITHUB_SCRAPER_MAX_TRIES='3',
+                      GITHUB_SCRAPER_MAX_WAIT='10', GITHUB_SCRAPER_ASYNC='1' if args.async_engine else '0')
+    import github_api
+    import rate_limit
+    failures = run_checks(server, github_api.app.test_client(), rate_limit)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,466 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import inspect
+import threading
+import functools
+import contextvars
+import concurrent.futures
+from collections import OrderedDict
+import single_flight
+import request_deadline
+import records
+
+#Settings of the scrape cache, configurable through the environment
+CACHE_BACKEND = os.environ.get('GITHUB_SCRAPER_CACHE', 'memory')               #memory, sqlite or off
+CACHE_PATH = os.environ.get('GITHUB_SCRAPER_CACHE_PATH', 'scrape_cache.sqlite3') #File used by the sqlite backend
+CACHE_SIZE = int(os.environ.get('GITHUB_SCRAPER_CACHE_SIZE', 1024))            #Maximum number of cached results
+CACHE_COMPACT = os.environ.get('GITHUB_SCRAPER_CACHE_COMPACT', '0') == '1'     #Memory backend keeps compact records
+
+#Time-to-live in seconds of each cached endpoint, each can be overridden with GITHUB_SCRAPER_CACHE_TTL_<ENDPOINT>
+DEFAULT_TTLS = {
+    "profile": 300,         #scrape_profile, behind both check_user_type and scrape_github_users_endpoint
+    "user_repos": 120,      #scrape_user_repo
+    "org_repos": 120,       #scrape_org_repo
+    "repo_page": 600,       #scrape_repo_page
+}
+
+#Stale-while-revalidate window in seconds after the TTL of the endpoints cached with serve_stale, during which the last
+#result is still served (and refreshed in the background), each can be overridden with GITHUB_SCRAPER_CACHE_STALE_<ENDPOINT>
+DEFAULT_STALE_TTLS = {
+    "profile": 3600,
+    "user_repos": 3600,
+    "org_repos": 3600,
+}
+
+#Hot keys of the serve_stale endpoints are refreshed by a background thread before they go stale
+HOT_KEYS = int(os.environ.get('GITHUB_SCRAPER_HOT_KEYS', 256))                      #Keys tracked, 0 turns the refresher off
+HOT_MIN_HITS = int(os.environ.get('GITHUB_SCRAPER_HOT_MIN_HITS', 2))                #Calls within the window making a key hot
+HOT_WINDOW = float(os.environ.get('GITHUB_SCRAPER_HOT_WINDOW', 600))                #Seconds since the last call a key stays hot
+REFRESH_INTERVAL = float(os.environ.get('GITHUB_SCRAPER_REFRESH_INTERVAL', 15))     #Seconds between two rounds of the refresher
+REFRESH_AHEAD = float(os.environ.get('GITHUB_SCRAPER_REFRESH_AHEAD', 0.8))          #Fraction of the TTL after which a hot key is refreshed
+REFRESH_WORKERS = int(os.environ.get('GITHUB_SCRAPER_REFRESH_WORKERS', 2))          #Threads running the background refreshes
+
+def endpoint_ttl(endpoint):
+    return float(os.environ.get(f'GITHUB_SCRAPER_CACHE_TTL_{endpoint.upper()}', DEFAULT_TTLS.get(endpoint, 60)))
+
+def endpoint_stale_ttl(endpoint):
+    return float(os.environ.get(f'GITHUB_SCRAPER_CACHE_STALE_{endpoint.upper()}', DEFAULT_STALE_TTLS.get(endpoint, 0)))
+
+_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "revalidated": 0, "stale": 0, "refreshes": 0, "refresh_errors": 0}
+_stats_lock = threading.Lock()
+
+def count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+#In-process backend: an LRU of (value, stored_at) pairs. Values are shared between callers and must not be mutated.
+#With compact, they are kept as records (records.py) instead, a third of the memory, and every caller gets its own dicts
+#back: building them costs more than encoding them, so it is only worth it when memory is the limit.
+class MemoryBackend:
+    def __init__(self, max_entries=CACHE_SIZE, compact=CACHE_COMPACT):
+        self.max_entries = max_entries
+        self.compact = compact
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is not None and self.compact:
+            return records.expand(entry[0]), entry[1]
+        return entry
+
+    def set(self, key, value, stored_at):
+        if self.compact:
+            value = records.compact(value)
+        with self.lock:
+            self.entries[key] = (value, stored_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                count('evictions')
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+#On-disk backend so a restarted (or another worker) process does not start cold. Values are stored as JSON.
+class SqliteBackend:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS scrape_cache (key TEXT PRIMARY KEY, value TEXT, stored_at REAL, used_at REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS scrape_cache_used_at ON scrape_cache (used_at)')
+
+    #One connection per thread and per process, sqlite connections can not be shared between them
+    def connection(self):
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def get(self, key):
+        with self.connection() as db:
+            row = db.execute('SELECT value, stored_at FROM scrape_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE scrape_cache SET used_at = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        with self.connection() as db:
+            db.execute('INSERT OR REPLACE INTO scrape_cache VALUES (?, ?, ?, ?)', (key, json.dumps(value), stored_at, time.time()))
+            overflow = db.execute('SELECT COUNT(*) FROM scrape_cache').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                db.execute('DELETE FROM scrape_cache WHERE key IN (SELECT key FROM scrape_cache ORDER BY used_at LIMIT ?)', (overflow,))
+                count('evictions', overflow)
+
+    def __len__(self):
+        with self.connection() as db:
+            return db.execute('SELECT COUNT(*) FROM scrape_cache').fetchone()[0]
+
+_backend = None
+_backend_ready = False
+_backend_lock = threading.Lock()
+
+#The backend named by GITHUB_SCRAPER_CACHE is created on first use, None means caching is off
+def get_backend():
+    global _backend, _backend_ready
+    with _backend_lock:
+        if not _backend_ready:
+            if CACHE_BACKEND == 'sqlite':
+                _backend = SqliteBackend()
+            elif CACHE_BACKEND == 'memory':
+                _backend = MemoryBackend()
+            _backend_ready = True
+        return _backend
+
+#Replaces the cache backend, None turns caching off
+def set_backend(backend):
+    global _backend, _backend_ready
+    with _backend_lock:
+        _backend = backend
+        _backend_ready = True
+
+def make_key(endpoint, args, kwargs):
+    return json.dumps([endpoint, args, sorted(kwargs.items())])
+
+#Value of a key when it is cached for at most max_age seconds, or MISSING, and its age
+MISSING = object()
+
+def lookup(backend, key, max_age):
+    entry = backend.get(key)
+    if entry is not None:
+        value, stored_at = entry
+        age = max(0, time.time() - stored_at)
+        if age <= max_age:
+            count('hits')
+            return value, age
+        count('expired')
+    count('misses')
+    return MISSING, None
+
+#Age of the oldest serve_stale result used, collected for the current API request (see track_age)
+_served_age = contextvars.ContextVar('served_age', default=None)
+
+#Starts collecting the age of the results served in the current context, the returned dict holds it under "age"
+def track_age():
+    served = {"age": None}
+    _served_age.set(served)
+    return served
+
+def record_age(age):
+    served = _served_age.get()
+    if served is not None and (served["age"] is None or age > served["age"]):
+        served["age"] = age
+
+_refresh_executor = None
+_refresh_executor_pid = None
+_refresh_executor_lock = threading.Lock()
+
+def get_refresh_executor():
+    global _refresh_executor, _refresh_executor_pid
+    with _refresh_executor_lock:
+        if _refresh_executor is None or _refresh_executor_pid != os.getpid():
+            _refresh_executor = concurrent.futures.ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='cache-refresh')
+            _refresh_executor_pid = os.getpid()
+        return _refresh_executor
+
+def refresh_done(future):
+    if future.cancelled() or future.exception() is not None:
+        count('refresh_errors')
+
+#Reruns a cached call in the background (refresh returns a concurrent.futures.Future), unless it is already running
+def start_refresh(key, refresh):
+    if single_flight.in_flight(key):
+        return
+    count('refreshes')
+    refresh().add_done_callback(refresh_done)
+
+#Keys of the serve_stale endpoints, most recently used last, with what the refresher needs to renew them
+class HotKeys:
+    def __init__(self, max_keys=HOT_KEYS):
+        self.max_keys = max_keys
+        self.keys = OrderedDict()
+        self.lock = threading.Lock()
+
+    def touch(self, key, endpoint, refresh):
+        now = time.time()
+        with self.lock:
+            entry = self.keys.pop(key, None)
+            hits = entry["hits"] + 1 if entry is not None and now - entry["used_at"] <= HOT_WINDOW else 1
+            self.keys[key] = {"endpoint": endpoint, "refresh": refresh, "used_at": now, "hits": hits}
+            while len(self.keys) > self.max_keys:
+                self.keys.popitem(last=False)
+
+    #Hot keys as (key, endpoint, refresh), keys not used within HOT_WINDOW are forgotten
+    def hot(self):
+        now = time.time()
+        with self.lock:
+            for key in [key for key, entry in self.keys.items() if now - entry["used_at"] > HOT_WINDOW]:
+                del self.keys[key]
+            return [(key, entry["endpoint"], entry["refresh"]) for key, entry in self.keys.items() if entry["hits"] >= HOT_MIN_HITS]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.keys)
+
+_hot_keys = HotKeys()
+_refresher_pid = None
+_refresher_lock = threading.Lock()
+
+#Background thread refreshing every hot key that is past REFRESH_AHEAD of its TTL, so hot users never go stale
+def refresher():
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        backend = get_backend()
+        if backend is None:
+            continue
+        for key, endpoint, refresh in _hot_keys.hot():
+            entry = backend.get(key)
+            if entry is None or time.time() - entry[1] > endpoint_ttl(endpoint) * REFRESH_AHEAD:
+                start_refresh(key, refresh)
+
+def start_refresher():
+    global _refresher_pid
+    with _refresher_lock:
+        if _refresher_pid != os.getpid():
+            _refresher_pid = os.getpid()
+            threading.Thread(target=refresher, name='cache-refresher', daemon=True).start()
+
+#Looks a call up in the cache, returns the value to serve or MISSING. For a serve_stale endpoint a value past its TTL
+#is still served during the endpoint's stale window while refresh() replaces it in the background, the age of what
+#is served is recorded and the key is tracked as a possible hot key.
+def serve_cached(endpoint, serve_stale, backend, key, refresh):
+    if backend is None:
+        return MISSING
+    ttl = endpoint_ttl(endpoint)
+    value, age = lookup(backend, key, ttl + endpoint_stale_ttl(endpoint) if serve_stale else ttl)
+    if serve_stale:
+        if HOT_KEYS > 0:
+            _hot_keys.touch(key, endpoint, refresh)
+            start_refresher()
+        if value is not MISSING:
+            record_age(age)
+            if age > ttl:
+                count('stale')
+                start_refresh(key, refresh)
+    return value
+
+#Caches value unless cacheable (the predicate given to cached) rejects it
+def store_value(backend, key, value, cacheable):
+    if backend is not None and (cacheable is None or cacheable(value)):
+        backend.set(key, value, time.time())
+
+#Passes the items of a streamed result on, and caches their list once all of them went through
+def store_items(backend, key, items, cacheable):
+    value = []
+    for item in items:
+        value.append(item)
+        yield item
+    store_value(backend, key, value, cacheable)
+
+async def store_items_async(backend, key, items, cacheable):
+    value = []
+    async for item in items:
+        value.append(item)
+        yield item
+    store_value(backend, key, value, cacheable)
+
+#Decorator caching the result of a scrape function for the TTL of its endpoint.
+#A hit skips both the download and the HTML parse. Exceptions are never cached.
+#Coroutine functions (async_scraper.py) are cached in the same entries as their synchronous counterparts.
+#On a miss (or with caching off) concurrent identical calls, from either engine, share one run (single_flight.py).
+#That run is not bound to the deadline of the request that started it (request_deadline.py), each caller only waits
+#for it as long as its own deadline allows and then gets DeadlineExceeded, the run goes on for the others.
+#serve_stale adds stale-while-revalidate and the background refresh of hot keys (see serve_cached).
+#cacheable(value), when given, keeps the results it returns False for (e.g. partial ones) out of the cache. Such a
+#function can return a partial result at the deadline, so a caller with a deadline runs it itself instead of waiting
+#on a shared run (the calls it makes, e.g. the repo pages, are still shared).
+#
+#For a function returning a list, wrapper.stream(iterate, *args) is its streaming counterpart: iterate takes the same
+#arguments and returns None or an iterator of the items (an async iterator for coroutine functions). A hit is streamed
+#from the cache, otherwise the items are passed on as iterate produces them and their complete list is cached.
+#Streams are not coalesced.
+def cached(endpoint, serve_stale=False, cacheable=None):
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            def loaders(backend, key, args, kwargs):
+                async def load():
+                    request_deadline.set_deadline(None)
+                    value = await function(*args, **kwargs)
+                    store_value(backend, key, value, cacheable)
+                    return value
+
+                #Refreshes run on the same event loop, outside of the request that started them (and its deadline)
+                loop = asyncio.get_running_loop()
+                async def background_load():
+                    _served_age.set(None)
+                    return await single_flight.do_async(key, load)
+                def refresh():
+                    return asyncio.run_coroutine_threadsafe(background_load(), loop)
+                return load, refresh
+
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                backend = get_backend()
+                key = make_key(endpoint, args, kwargs)
+                load, refresh = loaders(backend, key, args, kwargs)
+                value = serve_cached(endpoint, serve_stale, backend, key, refresh)
+                if value is MISSING:
+                    if cacheable is not None and request_deadline.get_deadline() is not None:
+                        value = await function(*args, **kwargs)
+                        store_value(backend, key, value, cacheable)
+                    else:
+                        try:
+                            value = await single_flight.do_async(key, load, request_deadline.remaining())
+                        except single_flight.WaitTimedOut:
+                            raise request_deadline.DeadlineExceeded('Request deadline passed while waiting for the scrape') from None
+                    if serve_stale:
+                        record_age(0)
+                return value
+
+            async def stream(iterate, *args, **kwargs):
+                backend = get_backend()
+                key = make_key(endpoint, args, kwargs)
+                load, refresh = loaders(backend, key, args, kwargs)
+                value = serve_cached(endpoint, serve_stale, backend, key, refresh)
+                if value is MISSING:
+                    if serve_stale:
+                        record_age(0)
+                    items = await iterate(*args, **kwargs)
+                    if items is not None:
+                        return store_items_async(backend, key, items, cacheable)
+                    value = None
+                    store_value(backend, key, value, cacheable)
+                return iterate_list(value) if value is not None else None
+        else:
+            def loaders(backend, key, args, kwargs):
+                def load():
+                    request_deadline.set_deadline(None)
+                    value = function(*args, **kwargs)
+                    store_value(backend, key, value, cacheable)
+                    return value
+
+                def refresh():
+                    return get_refresh_executor().submit(single_flight.do, key, load)
+                return load, refresh
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                backend = get_backend()
+                key = make_key(endpoint, args, kwargs)
+                load, refresh = loaders(backend, key, args, kwargs)
+                value = serve_cached(endpoint, serve_stale, backend, key, refresh)
+                if value is MISSING:
+                    if cacheable is not None and request_deadline.get_deadline() is not None:
+                        value = function(*args, **kwargs)
+                        store_value(backend, key, value, cacheable)
+                    else:
+                        try:
+                            value = single_flight.do(key, load, request_deadline.remaining())
+                        except single_flight.WaitTimedOut:
+                            raise request_deadline.DeadlineExceeded('Request deadline passed while waiting for the scrape') from None
+                    if serve_stale:
+                        record_age(0)
+                return value
+
+            def stream(iterate, *args, **kwargs):
+                backend = get_backend()
+                key = make_key(endpoint, args, kwargs)
+                load, refresh = loaders(backend, key, args, kwargs)
+                value = serve_cached(endpoint, serve_stale, backend, key, refresh)
+                if value is MISSING:
+                    if serve_stale:
+                        record_age(0)
+                    items = iterate(*args, **kwargs)
+                    if items is not None:
+                        return store_items(backend, key, items, cacheable)
+                    value = None
+                    store_value(backend, key, value, cacheable)
+                return iter(value) if value is not None else None
+
+        wrapper.uncached = function
+        wrapper.stream = stream
+        return wrapper
+    return decorator
+
+async def iterate_list(value):
+    for item in value:
+        yield item
+
+#Validators of a fetched page and the results extracted from it, stored in the same backend without a TTL.
+#They are only used to make re-fetches conditional, so they stay until evicted.
+def get_validated(url):
+    backend = get_backend()
+    entry = backend.get(make_key('validated', [url], {})) if backend is not None else None
+    return entry[0] if entry is not None else None
+
+def set_validated(url, etag, last_modified, result_key, result):
+    backend = get_backend()
+    if backend is None or (etag is None and last_modified is None):
+        return
+    validated = get_validated(url)
+    #Results extracted from an older version of the page are dropped
+    if validated is None or validated["etag"] != etag or validated["last_modified"] != last_modified:
+        validated = {"etag": etag, "last_modified": last_modified, "results": {}}
+    else:
+        validated = {"etag": etag, "last_modified": last_modified, "results": dict(validated["results"])}
+    validated["results"][result_key] = result
+    backend.set(make_key('validated', [url], {}), validated, time.time())
+
+#ETag of the last response of an API request (its path and query), stored with the time its oldest cached result was
+#scraped. While that is less than ttl ago, the scrape would give the same cached results again, so a client sending the
+#ETag back in If-None-Match can be answered 304 without scraping (see github_api.check_etag).
+def get_response_etag(path, ttl):
+    backend = get_backend()
+    entry = backend.get(make_key('response_etag', [path], {})) if backend is not None else None
+    if entry is None or time.time() - entry[1] > ttl:
+        return None
+    return entry[0]
+
+def set_response_etag(path, etag, age):
+    backend = get_backend()
+    if backend is not None:
+        backend.set(make_key('response_etag', [path], {}), etag, time.time() - (age or 0))
+
+def cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+    backend = get_backend()
+    stats["backend"] = type(backend).__name__ if backend is not None else None
+    stats["entries"] = len(backend) if backend is not None else 0
+    stats["hot_keys"] = len(_hot_keys)
+    return stats
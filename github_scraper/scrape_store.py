@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+#Settings of the persistent scrape store, configurable through the environment
+STORE_ENABLED = os.environ.get('GITHUB_SCRAPER_INCREMENTAL', '0') == '1'           #Incremental crawl on top of the store
+STORE_PATH = os.environ.get('GITHUB_SCRAPER_STORE_PATH', 'scrape_store.sqlite3')
+STORE_MAX_AGE = float(os.environ.get('GITHUB_SCRAPER_STORE_MAX_AGE', 86400))       #Seconds a stored repo page or profile is reused at most
+
+_stats = {"reused": 0, "scraped": 0, "changed": 0, "reused_users": 0}
+_stats_lock = threading.Lock()
+
+def count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+#Hash of a record as stored, equal hashes mean nothing GitHub shows of it changed
+def content_hash(record):
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+#Normalized records produced by the scrapers, kept across restarts: the profile of every user and the fields of
+#every repo's own page (with the pushed date of its listing row). fetched_at is when a record was last scraped,
+#changed_at when its content hash last changed.
+class ScrapeStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.local = threading.local()
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS users (login TEXT PRIMARY KEY, type INTEGER, record TEXT, content_hash TEXT, fetched_at REAL, changed_at REAL)')
+            db.execute('CREATE TABLE IF NOT EXISTS repos (url TEXT PRIMARY KEY, pushed_at TEXT, record TEXT, content_hash TEXT, fetched_at REAL, changed_at REAL)')
+
+    #One connection per thread and per process, sqlite connections can not be shared between them
+    def connection(self):
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            self.local.db = db
+            self.local.pid = os.getpid()
+        return db
+
+    def put_user(self, login, profile):
+        record_hash = content_hash(profile)
+        now = time.time()
+        with self.connection() as db:
+            db.execute('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (login) DO UPDATE SET '
+                       'type = excluded.type, record = excluded.record, fetched_at = excluded.fetched_at, '
+                       'changed_at = CASE WHEN users.content_hash = excluded.content_hash THEN users.changed_at ELSE excluded.changed_at END, '
+                       'content_hash = excluded.content_hash',
+                       (login, profile["type"], json.dumps(profile), record_hash, now, now))
+
+    def put_repo_page(self, url, pushed_at, repo_page):
+        record_hash = content_hash(repo_page)
+        now = time.time()
+        with self.connection() as db:
+            row = db.execute('SELECT content_hash FROM repos WHERE url = ?', (url,)).fetchone()
+            if row is not None and row[0] != record_hash:
+                count('changed')
+            db.execute('INSERT INTO repos VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET '
+                       'pushed_at = excluded.pushed_at, record = excluded.record, fetched_at = excluded.fetched_at, '
+                       'changed_at = CASE WHEN repos.content_hash = excluded.content_hash THEN repos.changed_at ELSE excluded.changed_at END, '
+                       'content_hash = excluded.content_hash',
+                       (url, pushed_at, json.dumps(repo_page), record_hash, now, now))
+
+    #Stored profile of login when it is at most max_age old
+    def get_user(self, login, max_age=STORE_MAX_AGE):
+        with self.connection() as db:
+            row = db.execute('SELECT record, fetched_at FROM users WHERE login = ?', (login,)).fetchone()
+        if row is None or time.time() - row[1] > max_age:
+            return None
+        return json.loads(row[0])
+
+    #Stored fields of the repos at urls that were not pushed to since (pushed_at equal to the listing's) and are at most max_age old
+    def get_repo_pages(self, urls, pushed_dates, max_age=STORE_MAX_AGE):
+        with self.connection() as db:
+            rows = {}
+            for start in range(0, len(urls), 500):
+                chunk = urls[start:start + 500]
+                query = f'SELECT url, pushed_at, record, fetched_at FROM repos WHERE url IN ({", ".join("?" * len(chunk))})'
+                rows.update((row[0], row[1:]) for row in db.execute(query, chunk))
+
+        repo_pages = []
+        for url, pushed_at in zip(urls, pushed_dates):
+            row = rows.get(url)
+            fresh = row is not None and pushed_at is not None and row[0] == pushed_at and time.time() - row[2] <= max_age
+            repo_pages.append(json.loads(row[1]) if fresh else None)
+        return repo_pages
+
+    def counts(self):
+        with self.connection() as db:
+            return {"users": db.execute('SELECT COUNT(*) FROM users').fetchone()[0], "repos": db.execute('SELECT COUNT(*) FROM repos').fetchone()[0]}
+
+_store = None
+_store_ready = False
+_store_lock = threading.Lock()
+
+#The store is created on first use when GITHUB_SCRAPER_INCREMENTAL=1, None means it is off
+def get_store():
+    global _store, _store_ready
+    with _store_lock:
+        if not _store_ready:
+            _store = ScrapeStore() if STORE_ENABLED else None
+            _store_ready = True
+        return _store
+
+def set_store(store):
+    global _store, _store_ready
+    with _store_lock:
+        _store = store
+        _store_ready = True
+
+def put_user(login, profile):
+    store = get_store()
+    if store is not None and profile is not None:
+        store.put_user(login, profile)
+
+#Incremental crawl: the stored profile of login, None when it has to be scraped again
+def stored_user(login):
+    store = get_store()
+    profile = store.get_user(login) if store is not None else None
+    if profile is not None:
+        count('reused_users')
+    return profile
+
+#Incremental crawl: the stored fields of every repo whose listing row shows no push since it was stored, None for
+#the repos whose own page has to be scraped again
+def stored_repo_pages(urls, pushed_dates):
+    store = get_store()
+    if store is None or pushed_dates is None:
+        return [None] * len(urls)
+    return store.get_repo_pages(urls, pushed_dates)
+
+#Yields the fields of every repo, the stored ones from stored_pages and the others from scraped_pages (the pages
+#of only those repos, in the same order), which are stored for the next crawl
+def merge_repo_pages(urls, pushed_dates, stored_pages, scraped_pages):
+    store = get_store()
+    for url, pushed_at, stored_page in zip(urls, pushed_dates or [None] * len(urls), stored_pages):
+        if stored_page is not None:
+            count('reused')
+            yield stored_page
+            continue
+        repo_page = next(scraped_pages)
+        store_repo_page(store, url, pushed_at, repo_page)
+        yield repo_page
+
+async def merge_repo_pages_async(urls, pushed_dates, stored_pages, scraped_pages):
+    store = get_store()
+    for url, pushed_at, stored_page in zip(urls, pushed_dates or [None] * len(urls), stored_pages):
+        if stored_page is not None:
+            count('reused')
+            yield stored_page
+            continue
+        repo_page = await scraped_pages.__anext__()
+        store_repo_page(store, url, pushed_at, repo_page)
+        yield repo_page
+
+#A repo page that failed (all fields empty) is not stored
+def store_repo_page(store, url, pushed_at, repo_page):
+    if store is None:
+        return
+    count('scraped')
+    if repo_page["id"] is not None:
+        store.put_repo_page(url, pushed_at, repo_page)
+
+def store_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    store = get_store()
+    stats["enabled"] = store is not None
+    stats.update(store.counts() if store is not None else {"users": 0, "repos": 0})
+    return stats
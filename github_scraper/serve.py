@@ -0,0 +1,44 @@
+import os
+import multiprocessing
+from gunicorn.app.base import BaseApplication
+
+#Production settings, configurable through the environment
+PORT = int(os.environ.get('GITHUB_API_PORT', 5000))
+WORKERS = int(os.environ.get('GITHUB_API_WORKERS', multiprocessing.cpu_count()))     #Worker processes
+THREADS = int(os.environ.get('GITHUB_API_THREADS', 8))                                #Request threads per worker
+TIMEOUT = int(os.environ.get('GITHUB_API_TIMEOUT', 120))                              #Seconds before a stuck worker is restarted
+GRACEFUL_TIMEOUT = int(os.environ.get('GITHUB_API_GRACEFUL_TIMEOUT', 30))             #Seconds for in-flight requests on shutdown
+KEEPALIVE = int(os.environ.get('GITHUB_API_KEEPALIVE', 5))
+
+#Runs the Flask app under gunicorn with threaded workers instead of the single-process development server.
+#The app is imported in each worker after the fork (no preload), so connection pools, worker pools and sqlite
+#connections are never shared between processes. The in-memory cache is per worker, GITHUB_SCRAPER_CACHE=sqlite shares it.
+class GunicornApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    #Called in every worker after the fork
+    def load(self):
+        from github_api import app
+        return app
+
+def main():
+    options = {
+        "bind": f'0.0.0.0:{PORT}',
+        "workers": WORKERS,
+        "worker_class": 'gthread',
+        "threads": THREADS,
+        "timeout": TIMEOUT,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "keepalive": KEEPALIVE,
+        "preload_app": False,
+    }
+    GunicornApplication(options).run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import os
+import asyncio
+import threading
+import contextvars
+import concurrent.futures
+
+#Single-flight: while a scrape is running, identical calls (same key) wait for its result instead of
+#downloading and parsing the same pages again. The result slot is a concurrent.futures.Future, so threads
+#(github_scraper.py) and asyncio tasks (async_scraper.py) can wait on the same call.
+_stats = {"flights": 0, "coalesced": 0, "in_flight": 0, "waiting": 0}
+_stats_lock = threading.Lock()
+
+#Threads running the calls whose leader has a timeout, so it can stop waiting for them
+FLIGHT_WORKERS = int(os.environ.get('GITHUB_SCRAPER_FLIGHT_WORKERS', 16))
+
+_flight_executor = None
+_flight_executor_pid = None
+_flight_executor_lock = threading.Lock()
+
+def get_flight_executor():
+    global _flight_executor, _flight_executor_pid
+    with _flight_executor_lock:
+        if _flight_executor is None or _flight_executor_pid != os.getpid():
+            _flight_executor = concurrent.futures.ThreadPoolExecutor(max_workers=FLIGHT_WORKERS, thread_name_prefix='single-flight')
+            _flight_executor_pid = os.getpid()
+        return _flight_executor
+
+def count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+#Raised to a caller that stopped waiting after its timeout, the call goes on for the others
+class WaitTimedOut(Exception):
+    pass
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.tasks = set()      #Running tasks of do_async, the loop only keeps weak references to them
+
+    #Returns the call for key and whether the caller leads it (has to run it)
+    def join(self, key):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                count('coalesced')
+                return call, False
+            call = self.calls[key] = concurrent.futures.Future()
+        count('flights')
+        return call, True
+
+    def in_flight(self, key):
+        with self.lock:
+            return key in self.calls
+
+    #Callers arriving after this start a new call
+    def leave(self, key):
+        with self.lock:
+            del self.calls[key]
+
+    #Returns the result of function for key, run once for every caller arriving while it runs. A caller stops waiting
+    #after timeout seconds (None waits until it is done) with a TimeoutError, the call itself goes on for the others:
+    #a leader with a timeout runs it on the flight executor instead of its own thread. function runs in a copy of the
+    #leader's context.
+    def do(self, key, function, timeout=None):
+        call, leader = self.join(key)
+        if leader and timeout is None:
+            self.run(key, call, contextvars.copy_context().run, function)
+        elif leader:
+            get_flight_executor().submit(self.run, key, call, contextvars.copy_context().run, function)
+        else:
+            count('waiting')
+        try:
+            return call.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            #The call itself may have raised a TimeoutError
+            if call.done():
+                return call.result()
+            raise WaitTimedOut(key) from None
+        finally:
+            if not leader:
+                count('waiting', -1)
+
+    def run(self, key, call, function, *args):
+        count('in_flight')
+        try:
+            result = function(*args)
+        except BaseException as e:
+            self.leave(key)
+            call.set_exception(e)
+            return
+        finally:
+            count('in_flight', -1)
+        self.leave(key)
+        call.set_result(result)
+
+    #Same as do for a coroutine function, run as a task of its own: a caller that is cancelled or times out does not
+    #cancel the call of the others
+    async def do_async(self, key, function, timeout=None):
+        call, leader = self.join(key)
+        if leader:
+            task = asyncio.ensure_future(self.run_async(key, call, function))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        else:
+            count('waiting')
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(call)), timeout)
+        except asyncio.TimeoutError:
+            if call.done():
+                return call.result()
+            raise WaitTimedOut(key) from None
+        finally:
+            if not leader:
+                count('waiting', -1)
+
+    async def run_async(self, key, call, function):
+        count('in_flight')
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            self.leave(key)
+            call.cancel()
+            raise
+        except BaseException as e:
+            self.leave(key)
+            call.set_exception(e)
+            return
+        finally:
+            count('in_flight', -1)
+        self.leave(key)
+        call.set_result(result)
+
+_flights = SingleFlight()
+
+def do(key, function, timeout=None):
+    return _flights.do(key, function, timeout)
+
+async def do_async(key, function, timeout=None):
+    return await _flights.do_async(key, function, timeout)
+
+def in_flight(key):
+    return _flights.in_flight(key)
+
+def flight_stats():
+    with _stats_lock:
+        return dict(_stats)